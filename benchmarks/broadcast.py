@@ -0,0 +1,271 @@
+"""Broadcast throughput, handler latency and memory of PremiumBot against a fake Bot API.
+
+Starts benchmarks/fake_telegram.py in its own process, then runs one bot process
+per audience size. Each run seeds MongoDB with that many users, times /start and
+plain user messages through the real handlers, and sends an all-user broadcast.
+
+    python benchmarks/broadcast.py --in-memory --audiences 1000,100000
+    python benchmarks/broadcast.py --mongodb-url mongodb://127.0.0.1:27017 --reset-db \\
+        --audiences 1000,100000,1000000 --latency-ms 20 --flood-rate 0.001 --forbidden-rate 0.02
+
+--in-memory needs mongomock (pip install -r benchmarks/requirements.txt). With a
+real MongoDB the bot's premium_bot database is used, so point it at a scratch
+server; --reset-db drops that database before every run.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import resource
+import subprocess
+from datetime import datetime
+
+from fake_telegram import ADMIN_ID, FIRST_USER_ID, bot_environment, make_text_update, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEED_BATCH = 10000
+
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3) if values else None
+    }
+
+def broadcast_environment(args):
+    env = bot_environment(args.api_port, args.mongodb_url or "mongodb://in-memory")
+    env.update({
+        "BROADCAST_RATE": str(args.rate),
+        "BROADCAST_GLOBAL_RATE": str(args.global_rate),
+        "BROADCAST_CONCURRENCY": str(args.concurrency),
+        "BROADCAST_CHUNK_SIZE": str(args.chunk_size),
+        # Nothing periodic should run in the middle of a measurement
+        "MEMBERSHIP_REFRESH_SECONDS": "0",
+        "COUNTERS_RECONCILE_SECONDS": "0",
+        "INVITE_POOL_SIZE": "0",
+        "UPDATE_WORKERS": "0",
+        "BROADCAST_WORKERS": "0"
+    })
+    env.pop("METRICS_PORT", None)
+    return env
+
+def wait_for_port(port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Fake Bot API did not start on port {port}")
+
+async def seed_users(bot, audience: int):
+    now = datetime.now()
+    for start in range(0, audience, SEED_BATCH):
+        users = [
+            {"user_id": user_id, "username": f"user{user_id}", "last_seen": now}
+            for user_id in range(FIRST_USER_ID + start, FIRST_USER_ID + min(audience, start + SEED_BATCH))
+        ]
+        await bot.all_users.insert_many(users, ordered=False)
+
+async def measure_handlers(application, args, update_class):
+    # Updates are processed one at a time, so this is handler latency without queueing
+    rng = random.Random(args.seed)
+    latencies = {"start": [], "user_message_handler": []}
+
+    for update_id in range(1, args.handler_updates + 1):
+        user_id = FIRST_USER_ID + rng.randrange(args.audience)
+        if update_id % 2:
+            name, text = "start", "/start"
+        else:
+            name, text = "user_message_handler", f"benchmark message {update_id}"
+
+        update = update_class.de_json(make_text_update(update_id, user_id, text), application.bot)
+        started = time.perf_counter()
+        await application.process_update(update)
+        latencies[name].append(time.perf_counter() - started)
+
+    return {name: latency_summary(values) for name, values in latencies.items()}
+
+async def run_audience(args):
+    import main
+
+    if args.in_memory:
+        import mongomock
+        client = mongomock.MongoClient()
+        main.MongoClient = lambda *a, **kwargs: client
+
+    bot = main.PremiumBot()
+    if args.reset_db:
+        bot.client.drop_database(bot.db.name)
+    elif await bot.all_users.count_documents({}, limit=1):
+        raise RuntimeError(f"{bot.db.name} already has users; use a scratch database or pass --reset-db")
+
+    started = time.perf_counter()
+    await seed_users(bot, args.audience)
+    seed_seconds = time.perf_counter() - started
+
+    application = main.build_application(bot, updater=False)
+
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+
+        handlers = await measure_handlers(application, args, main.Update)
+
+        item = {"chat_id": ADMIN_ID, "message_id": 1, "media_group_id": None, "text": "Benchmark broadcast"}
+        started = time.perf_counter()
+        job = await bot.create_broadcast_job('all', ADMIN_ID, "📢 Admin Broadcast:\n\n", [item])
+        snapshot_seconds = time.perf_counter() - started
+
+        attempts_before = sum(main.SEND_ATTEMPTS.values.values())
+        started = time.perf_counter()
+        await bot.run_broadcast_job(application.bot, job)
+        send_seconds = time.perf_counter() - started
+
+        await application.stop()
+        await bot.post_shutdown(application)
+
+    results = {}
+    for (method, result), count in main.SEND_RESULTS.values.items():
+        results[result] = results.get(result, 0) + count
+
+    return {
+        "audience": args.audience,
+        "seed_s": round(seed_seconds, 3),
+        "snapshot_s": round(snapshot_seconds, 3),
+        "broadcast": {
+            "duration_s": round(send_seconds, 3),
+            "successful": job['successful_sends'],
+            "failed": job['failed_sends'],
+            "api_calls": sum(main.SEND_ATTEMPTS.values.values()) - attempts_before,
+            "results": results,
+            "msgs_per_s": round((job['successful_sends'] + job['failed_sends']) / send_seconds, 1) if send_seconds else None
+        },
+        "handlers": handlers,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+def run_one(args):
+    # Child process: one audience size, result as JSON on stdout
+    import logging
+    sys.path.insert(0, ROOT)
+    import main  # configures logging, so the level is set afterwards
+    main.logger.root.setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+
+    result = asyncio.run(run_audience(args))
+    print(json.dumps(result))
+
+def run_suite(args):
+    fake = subprocess.Popen(
+        [
+            sys.executable, os.path.join(HERE, "fake_telegram.py"),
+            "--port", str(args.api_port),
+            "--latency-ms", str(args.latency_ms),
+            "--flood-rate", str(args.flood_rate),
+            "--forbidden-rate", str(args.forbidden_rate),
+            "--retry-after", str(args.retry_after),
+            "--seed", str(args.seed)
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL
+    )
+
+    report = {
+        "config": {
+            "in_memory": args.in_memory,
+            "rate": args.rate,
+            "global_rate": args.global_rate,
+            "concurrency": args.concurrency,
+            "chunk_size": args.chunk_size,
+            "latency_ms": args.latency_ms,
+            "flood_rate": args.flood_rate,
+            "forbidden_rate": args.forbidden_rate,
+            "handler_updates": args.handler_updates,
+            "python": sys.version.split()[0]
+        },
+        "results": []
+    }
+
+    try:
+        wait_for_port(args.api_port, 30)
+
+        for audience in args.audiences:
+            command = [sys.executable, os.path.abspath(__file__), "--single", str(audience)] + args.passthrough
+            completed = subprocess.run(
+                command,
+                env=broadcast_environment(args),
+                cwd=ROOT,
+                stdout=subprocess.PIPE,
+                stderr=None,
+                text=True
+            )
+            if completed.returncode != 0:
+                report['results'].append({"audience": audience, "error": f"exit code {completed.returncode}"})
+                continue
+            report['results'].append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    finally:
+        fake.terminate()
+        fake.wait(timeout=10)
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audiences", default="1000,100000,1000000", help="comma separated audience sizes")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock instead of a MongoDB server")
+    parser.add_argument("--mongodb-url", default=os.getenv("MONGODB_URL"), help="scratch MongoDB server (default: $MONGODB_URL)")
+    parser.add_argument("--reset-db", action="store_true", help="drop the bot's database before every run")
+    parser.add_argument("--rate", type=float, default=100000, help="BROADCAST_RATE for the run")
+    parser.add_argument("--global-rate", type=int, default=0, help="BROADCAST_GLOBAL_RATE for the run (0 = off)")
+    parser.add_argument("--concurrency", type=int, default=25, help="BROADCAST_CONCURRENCY for the run")
+    parser.add_argument("--chunk-size", type=int, default=500, help="BROADCAST_CHUNK_SIZE for the run")
+    parser.add_argument("--handler-updates", type=int, default=1000, help="updates used to measure handler latency")
+    parser.add_argument("--latency-ms", type=float, default=0, help="fake Bot API latency per send")
+    parser.add_argument("--flood-rate", type=float, default=0, help="fraction of sends answered with 429")
+    parser.add_argument("--forbidden-rate", type=float, default=0, help="fraction of sends answered with 403")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after returned with a 429")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's and the fake server's logs")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.in_memory and not args.mongodb_url:
+        parser.error("pass --in-memory or --mongodb-url (or set MONGODB_URL)")
+
+    if args.single is not None:
+        args.audience = args.single
+        run_one(args)
+        return
+
+    args.audiences = [int(size) for size in args.audiences.split(",") if size]
+    # Options the per-audience processes need
+    args.passthrough = [
+        "--handler-updates", str(args.handler_updates),
+        "--seed", str(args.seed),
+        "--api-port", str(args.api_port)
+    ]
+    if args.mongodb_url:
+        args.passthrough += ["--mongodb-url", args.mongodb_url]
+    for flag in ("in_memory", "reset_db", "verbose"):
+        if getattr(args, flag):
+            args.passthrough.append("--" + flag.replace("_", "-"))
+
+    report = run_suite(args)
+    output = json.dumps(report, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
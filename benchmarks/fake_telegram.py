@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+from urllib.parse import parse_qsl
+
+import httpx
+from tornado.httpserver import HTTPServer
+from tornado.web import Application, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    "id": 777000111,
+    "is_bot": True,
+    "first_name": "Bench Bot",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False
+}
+
+# Shared by the benchmark scripts
+ADMIN_ID = 1
+FIRST_USER_ID = 100000
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def bot_environment(api_port: int, mongodb_url: str):
+    # Environment for a bot process that talks to the fake Bot API on api_port
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": "123456:BENCHMARK",
+        "ADMIN_ID": str(ADMIN_ID),
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "MONGODB_URL": mongodb_url
+    })
+    env.pop("WEBHOOK_URL", None)
+    return env
+
+def make_text_update(update_id: int, user_id: int, text: str):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"},
+        "text": text
+    }
+    if text.startswith('/'):
+        # Telegram marks commands with an entity; CommandHandler relies on it
+        message['entities'] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+class ApiError(Exception):
+    def __init__(self, code: int, description: str, retry_after: int = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+    def response(self):
+        response = {"ok": False, "error_code": self.code, "description": self.description}
+        if self.retry_after is not None:
+            response['parameters'] = {"retry_after": self.retry_after}
+        return response
+
+class FakeTelegram:
+    # In-process stand-in for the Bot API: serves getUpdates, receives setWebhook and
+    # records every outgoing call so benchmarks can time the bot's responses.
+    # Sends to users can be slowed down and made to fail with flood control (429) or a
+    # blocked bot (403) at the given rates.
+    def __init__(self, port: int, latency: float = 0, flood_rate: float = 0, forbidden_rate: float = 0,
+                 retry_after: int = 1, seed: int = None):
+        self.port = port
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.forbidden_rate = forbidden_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.webhook = None
+        self.webhook_queue = asyncio.Queue()
+        self.webhook_tasks = []
+        self.listeners = []
+        self.calls = {}
+        self.server = None
+
+    def start(self):
+        app = Application([(r"/bot([^/]+)/(\w+)", BotApiHandler, {"fake": self})])
+        self.server = HTTPServer(app)
+        self.server.listen(self.port, address="127.0.0.1")
+
+    async def stop(self):
+        for task in self.webhook_tasks:
+            task.cancel()
+
+        # Release pending long polls before closing the server
+        self.new_updates.set()
+        await asyncio.sleep(0.1)
+        if self.server:
+            self.server.stop()
+
+    def inject(self, update: dict):
+        if self.webhook:
+            self.webhook_queue.put_nowait(update)
+        else:
+            self.updates.append(update)
+            self.new_updates.set()
+
+    def inject_text(self, user_id: int, text: str):
+        update = make_text_update(next(self.update_ids), user_id, text)
+        self.inject(update)
+        return update
+
+    async def get_updates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        self.ready.set()
+
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        limit = int(params.get('limit') or 100)
+        return self.updates[:limit]
+
+    def set_webhook(self, params: dict):
+        for task in self.webhook_tasks:
+            task.cancel()
+
+        self.webhook = {
+            "url": params['url'],
+            "secret_token": params.get('secret_token'),
+            "max_connections": int(params.get('max_connections') or 40)
+        }
+        self.webhook_tasks = [
+            asyncio.create_task(self.push_webhooks())
+            for _ in range(self.webhook['max_connections'])
+        ]
+
+        # Anything queued for polling is delivered through the webhook instead
+        for update in self.updates:
+            self.webhook_queue.put_nowait(update)
+        self.updates = []
+        self.ready.set()
+        return True
+
+    async def push_webhooks(self):
+        headers = {}
+        if self.webhook['secret_token']:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook['secret_token']
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            while True:
+                update = await self.webhook_queue.get()
+                try:
+                    await client.post(self.webhook['url'], json=update, headers=headers)
+                except Exception as e:
+                    logger.error(f"Webhook delivery failed: {e}")
+
+    def record(self, method: str, params: dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        now = time.monotonic()
+        for listener in self.listeners:
+            listener(now, method, params)
+
+    def message_result(self, params: dict):
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get('chat_id', 0)), "type": "private"},
+            "text": params.get('text', '')
+        }
+
+    async def call(self, method: str, params: dict):
+        self.record(method, params)
+
+        if method.startswith(('send', 'copy', 'forward')):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+            roll = self.random.random()
+            if roll < self.flood_rate:
+                self.record('error:429', params)
+                raise ApiError(429, f"Too Many Requests: retry after {self.retry_after}", self.retry_after)
+            if roll < self.flood_rate + self.forbidden_rate:
+                self.record('error:403', params)
+                raise ApiError(403, "Forbidden: bot was blocked by the user")
+
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method == 'setWebhook':
+            return self.set_webhook(params)
+        if method == 'deleteWebhook':
+            self.webhook = None
+            return True
+        if method == 'copyMessage':
+            return {"message_id": next(self.message_ids)}
+        if method == 'sendMediaGroup':
+            return [self.message_result(params) for _ in json.loads(params.get('media') or '[]')]
+        if method.startswith('send') or method.startswith('forward'):
+            return self.message_result(params)
+        if method == 'getChatMember':
+            return {"status": "left", "user": {"id": int(params.get('user_id', 0)), "is_bot": False, "first_name": "User"}}
+        if method == 'getChat':
+            return {"id": int(params.get('chat_id', 0)), "type": "channel", "title": "Bench Channel"}
+        if method == 'createChatInviteLink':
+            return {
+                "invite_link": f"https://t.me/+bench{next(self.message_ids)}",
+                "creator": BOT_USER,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False
+            }
+        return True
+
+class BotApiHandler(RequestHandler):
+    def initialize(self, fake: FakeTelegram):
+        self.fake = fake
+
+    def parse_params(self):
+        params = {key: values[-1].decode() for key, values in self.request.arguments.items()}
+
+        content_type = self.request.headers.get('Content-Type', '')
+        if content_type.startswith('application/json') and self.request.body:
+            params.update(json.loads(self.request.body))
+        elif content_type.startswith('application/x-www-form-urlencoded'):
+            params.update(parse_qsl(self.request.body.decode()))
+
+        # python-telegram-bot sends non-string values JSON encoded
+        for key, value in params.items():
+            if isinstance(value, str) and key in ('offset', 'timeout', 'limit', 'chat_id', 'user_id', 'max_connections'):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    pass
+        return params
+
+    async def post(self, token: str, method: str):
+        self.set_header('Content-Type', 'application/json')
+        try:
+            result = await self.fake.call(method, self.parse_params())
+        except ApiError as e:
+            self.set_status(e.code)
+            self.write(json.dumps(e.response()))
+            return
+        self.write(json.dumps({"ok": True, "result": result}))
+
+    async def get(self, token: str, method: str):
+        await self.post(token, method)
+
+async def serve(args):
+    fake = FakeTelegram(
+        args.port,
+        latency=args.latency_ms / 1000,
+        flood_rate=args.flood_rate,
+        forbidden_rate=args.forbidden_rate,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+    fake.start()
+    logger.info(f"Fake Bot API listening on 127.0.0.1:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fake Bot API server on its own")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every send")
+    parser.add_argument("--flood-rate", type=float, default=0, help="fraction of sends answered with 429")
+    parser.add_argument("--forbidden-rate", type=float, default=0, help="fraction of sends answered with 403")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after returned with a 429")
+    parser.add_argument("--seed", type=int, help="seed for the injected errors")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    # One access log line per request would cost more than the fake API itself
+    logging.getLogger('tornado.access').setLevel(logging.WARNING)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
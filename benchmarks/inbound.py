@@ -0,0 +1,136 @@
+"""Inbound latency/throughput of polling vs webhook mode against a fake Bot API.
+
+Starts the fake server, runs main.py as a subprocess pointed at it, injects
+text messages from distinct users and times how long each takes until the
+bot's "Message sent to admin" reply comes back.
+
+    python benchmarks/inbound.py --mode polling --updates 2000
+    python benchmarks/inbound.py --mode webhook --updates 2000 --rate 500
+
+MONGODB_URL must point at a MongoDB the benchmark may write to.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import statistics
+
+from fake_telegram import FIRST_USER_ID, FakeTelegram, bot_environment, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+def inbound_environment(args):
+    env = bot_environment(args.api_port, os.environ.get("MONGODB_URL", "mongodb://127.0.0.1:27017"))
+
+    if args.mode == "webhook":
+        env.update({
+            "WEBHOOK_URL": f"http://127.0.0.1:{args.webhook_port}",
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "WEBHOOK_PORT": str(args.webhook_port),
+            "WEBHOOK_SECRET": "benchmark-secret",
+            "WEBHOOK_MAX_CONNECTIONS": str(args.max_connections)
+        })
+    return env
+
+async def run(args):
+    fake = FakeTelegram(args.api_port, latency=args.latency_ms / 1000)
+    fake.start()
+
+    sent_at = {}
+    latencies = []
+    done = asyncio.Event()
+
+    def on_call(now, method, params):
+        if method != "sendMessage":
+            return
+        started = sent_at.pop(params.get("chat_id"), None)
+        if started is not None:
+            latencies.append(now - started)
+            if len(latencies) == args.updates:
+                done.set()
+
+    fake.listeners.append(on_call)
+
+    command = args.bot_command or [sys.executable, os.path.join(ROOT, "main.py")]
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        env=inbound_environment(args),
+        cwd=ROOT,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=None if args.verbose else asyncio.subprocess.DEVNULL
+    )
+
+    result = {"mode": args.mode, "updates": args.updates}
+    try:
+        await asyncio.wait_for(fake.ready.wait(), args.startup_timeout)
+        if args.mode == "webhook":
+            # Give the webhook server a moment after setWebhook before pushing to it
+            await asyncio.sleep(1)
+
+        started = time.monotonic()
+        for i in range(args.updates):
+            user_id = FIRST_USER_ID + i
+            sent_at[user_id] = time.monotonic()
+            fake.inject_text(user_id, f"benchmark message {i}")
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+            elif i % 100 == 0:
+                await asyncio.sleep(0)
+
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.monotonic() - started
+
+        result.update({
+            "answered": len(latencies),
+            "duration_s": round(elapsed, 3),
+            "throughput_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+                "p90": round(percentile(latencies, 0.90) * 1000, 1) if latencies else None,
+                "p99": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+                "mean": round(statistics.mean(latencies) * 1000, 1) if latencies else None
+            },
+            "api_calls": fake.calls
+        })
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), 15)
+            except asyncio.TimeoutError:
+                process.kill()
+        await fake.stop()
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--updates", type=int, default=1000, help="number of inbound messages")
+    parser.add_argument("--rate", type=float, default=0, help="injected updates per second (0 = as fast as possible)")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    parser.add_argument("--max-connections", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=0, help="fake Bot API latency per send")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for all replies")
+    parser.add_argument("--bot-command", nargs="+", help="command used to start the bot (default: python main.py)")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log output")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
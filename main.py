@@ -1,11 +1,40 @@
 
 import os
+import re
+import sys
+import time
+import asyncio
 import logging
+import functools
+import signal
+import multiprocessing
+import itertools
+import math
+import random
+import socket
+import bisect
+import io
+import cProfile
+import pstats
+import tracemalloc
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember,
+    InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+)
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ChatMemberHandler,
+    TypeHandler, BaseUpdateProcessor
+)
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, ExecutionTimeout, WTimeoutError
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
 
 # Configure logging
 logging.basicConfig(
@@ -13,47 +42,1247 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# The job queue logs every run of the periodic jobs at INFO
+logging.getLogger('apscheduler').setLevel(logging.WARNING)
+
+def format_labels(names, values, extra: str = ''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+    
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, label_values)} {value}"
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self.values = {}
+    
+    def observe(self, value: float, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+    
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}"
+
+class Gauge:
+    # Read when scraped, so it always reports the current value
+    def __init__(self, name: str, help: str, read):
+        self.name = name
+        self.help = help
+        self.read = read
+    
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.read()}"
+
+class MetricsRegistry:
+    # Metrics in the Prometheus text format, served on METRICS_PORT when it is set
+    def __init__(self):
+        self.metrics = {}
+    
+    def register(self, metric):
+        # Re-registering a name replaces it (a gauge bound to a newer bot instance)
+        self.metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help: str, labels: tuple = ()):
+        return self.register(Counter(name, help, labels))
+    
+    def histogram(self, name: str, help: str, labels: tuple = ()):
+        return self.register(Histogram(name, help, labels))
+    
+    def gauge(self, name: str, help: str, read):
+        return self.register(Gauge(name, help, read))
+    
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error(f"Error rendering metric {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+class MetricsHandler(RequestHandler):
+    def initialize(self, registry: MetricsRegistry):
+        self.registry = registry
+    
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.registry.render())
+
+def start_metrics_server(port: int):
+    server = HTTPServer(WebApplication([(r"/metrics", MetricsHandler, {"registry": METRICS})]))
+    server.listen(port)
+    logger.info(f"Serving metrics on port {port}")
+    return server
+
+METRICS = MetricsRegistry()
+HANDLER_SECONDS = METRICS.histogram("bot_handler_seconds", "Time spent in each update handler", ("handler",))
+MONGO_SECONDS = METRICS.histogram("bot_mongo_seconds", "MongoDB operation latency, including the wait for a pool thread", ("collection", "operation"))
+SEND_ATTEMPTS = METRICS.counter("bot_send_attempts_total", "Bulk Bot API calls attempted", ("method",))
+SEND_RESULTS = METRICS.counter("bot_send_results_total", "Bulk Bot API call results by error class (ok on success)", ("method", "result"))
+SEND_SECONDS = METRICS.histogram("bot_send_seconds", "Bulk Bot API call latency", ("method",))
+
+def timed(callback):
+    # Handler latency, labelled with the callback's name
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.monotonic()
+        try:
+            return await callback(update, context)
+        finally:
+            HANDLER_SECONDS.observe(time.monotonic() - started, callback.__name__)
+    return wrapper
+
+def format_profile_report(profiler: cProfile.Profile, before, after, seconds: int, limit: int = 30):
+    out = io.StringIO()
+    out.write(f"Profile of {seconds}s, process {os.getpid()}, {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    out.write("CPU time is for the event loop thread; MongoDB calls show up as time spent waiting on the pool.\n\n")
+    
+    for sort_key in ('cumulative', 'tottime'):
+        out.write(f"=== Hot functions by {sort_key} time ===\n")
+        pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort_key).print_stats(limit)
+    
+    ignored = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>")
+    )
+    before = before.filter_traces(ignored)
+    after = after.filter_traces(ignored)
+    
+    out.write(f"=== Allocation growth during the window (top {limit}) ===\n")
+    for stat in after.compare_to(before, 'lineno')[:limit]:
+        out.write(f"{stat}\n")
+    
+    out.write(f"\n=== Largest live allocation sites (top {limit}) ===\n")
+    for stat in after.statistics('lineno')[:limit]:
+        out.write(f"{stat}\n")
+    
+    return out.getvalue()
+
+def remove_duplicates(collection, key):
+    # Keep the oldest document for each key so a unique index can be built
+    duplicates = collection.aggregate([
+        {"$group": {"_id": f"${key}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    
+    for duplicate in duplicates:
+        extra_ids = sorted(duplicate['ids'])[1:]
+        collection.delete_many({"_id": {"$in": extra_ids}})
+        logger.warning(f"Removed {len(extra_ids)} duplicate {collection.name} documents for {key}={duplicate['_id']}")
+
+def migrate_initial_indexes(db):
+    for name in ('premium_users', 'banned_users', 'all_users'):
+        remove_duplicates(db[name], 'user_id')
+        db[name].create_index('user_id', unique=True)
+    
+    remove_duplicates(db.premium_channels, 'channel_id')
+    db.premium_channels.create_index('channel_id', unique=True)
+    db.broadcast_logs.create_index('timestamp')
+
+def migrate_broadcast_jobs(db):
+    db.broadcast_jobs.create_index('status')
+    db.broadcast_chunks.create_index([('job_id', 1), ('status', 1), ('seq', 1)])
+
+def migrate_channel_members(db):
+    db.channel_members.create_index([('channel_id', 1), ('user_id', 1)], unique=True)
+
+def migrate_broadcast_leases(db):
+    # Chunks are claimed across jobs by status; expired leases are found by lease_expires
+    db.broadcast_chunks.create_index([('status', 1), ('job_id', 1), ('seq', 1)])
+    db.broadcast_chunks.create_index([('status', 1), ('lease_expires', 1)])
+    db.rate_budget.create_index('expires', expireAfterSeconds=0)
+
+def migrate_message_routes(db):
+    db.message_routes.create_index('message_id', unique=True)
+    db.message_routes.create_index('expires', expireAfterSeconds=0)
+
+def migrate_audience_segments(db):
+    db.all_users.create_index('last_seen')
+    db.all_users.create_index('username')
+
+# Schema migrations, applied in order; never reorder or remove entries
+MIGRATIONS = [
+    migrate_initial_indexes,
+    migrate_broadcast_jobs,
+    migrate_channel_members,
+    migrate_broadcast_leases,
+    migrate_message_routes,
+    migrate_audience_segments,
+]
+
+def run_migrations(db):
+    record = db.migrations.find_one({"_id": "schema"}) or {}
+    version = record.get('version', 0)
+    
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        logger.info(f"Applying migration {number}: {migration.__name__}")
+        migration(db)
+        db.migrations.update_one(
+            {"_id": "schema"},
+            {"$set": {"version": number, "applied_date": datetime.now()}},
+            upsert=True
+        )
+    
+    return len(MIGRATIONS)
+
+# MongoDB errors worth retrying instead of abandoning a half-sent broadcast
+TRANSIENT_MONGO_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+
+# Media types that accept a caption when copied, and those that can be part of an album
+CAPTION_MEDIA_TYPES = ('photo', 'video', 'document', 'audio', 'voice', 'animation')
+INPUT_MEDIA_TYPES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio
+}
+
+def capture_message(message):
+    # Everything needed to re-deliver a message later, in a form that can be stored in MongoDB
+    item = {
+        "chat_id": message.chat_id,
+        "message_id": message.message_id,
+        "media_group_id": message.media_group_id
+    }
+    
+    if message.text:
+        item['text'] = message.text
+        return item
+    
+    item['caption'] = message.caption or ''
+    item['captionable'] = any(getattr(message, media_type) for media_type in CAPTION_MEDIA_TYPES)
+    
+    # Album members also keep their file so the album can be re-sent with send_media_group
+    if message.media_group_id and not message.animation:
+        if message.photo:
+            item['media'] = {"type": "photo", "media": message.photo[-1].file_id}
+        elif message.video:
+            item['media'] = {"type": "video", "media": message.video.file_id}
+        elif message.document:
+            item['media'] = {"type": "document", "media": message.document.file_id}
+        elif message.audio:
+            item['media'] = {"type": "audio", "media": message.audio.file_id}
+    
+    return item
+
+def copy_step(item, header: str):
+    step = {
+        "method": "copy_message",
+        "from_chat_id": item['chat_id'],
+        "message_id": item['message_id']
+    }
+    if item.get('captionable'):
+        step['caption'] = f"{header}{item['caption']}"
+    return step
+
+def compile_payload(items, header: str):
+    # Turn captured messages into API calls, with the header already applied
+    steps = []
+    albums = {}
+    
+    for item in items:
+        group_id = item.get('media_group_id')
+        
+        if group_id and item.get('media'):
+            media = dict(item['media'], caption=item['caption'] or None)
+            if group_id in albums:
+                albums[group_id][0]['media'].append(media)
+            else:
+                media['caption'] = f"{header}{item['caption']}"
+                albums[group_id] = ({"method": "send_media_group", "media": [media]}, item)
+                steps.append(albums[group_id][0])
+        elif 'text' in item:
+            steps.append({"method": "send_message", "text": f"{header}{item['text']}"})
+        else:
+            steps.append(copy_step(item, header))
+    
+    # A media group needs at least two items; a lone album member (an album reply, or an
+    # album split by the flush delay) is copied like any other message
+    for step, first_item in albums.values():
+        if len(step['media']) == 1:
+            step.clear()
+            step.update(copy_step(first_item, header))
+    
+    return steps
+
+def prepare_payload(steps):
+    # Build the per-call keyword arguments once per broadcast; only chat_id varies per recipient
+    prepared = []
+    
+    for step in steps:
+        kwargs = {key: value for key, value in step.items() if key != 'method'}
+        if step['method'] == 'send_media_group':
+            kwargs['media'] = [
+                INPUT_MEDIA_TYPES[media['type']](media=media['media'], caption=media.get('caption'))
+                for media in step['media']
+            ]
+        prepared.append((step['method'], kwargs))
+    
+    return prepared
+
+SEGMENT_USAGE = (
+    "Usage: /allbroadcast [filters]\n"
+    "Filters (combine any):\n"
+    "• active:<days> - seen in the last <days> days\n"
+    "• premium / nonpremium - premium members or everyone else\n"
+    "• username:<prefix> - username starts with <prefix> (case-sensitive)"
+)
+
+def parse_segment(args):
+    # /allbroadcast filters -> segment dict stored with the broadcast job; ValueError if invalid
+    segment = {}
+    for arg in args:
+        name, _, value = arg.partition(':')
+        name = name.lower()
+        
+        if name == 'active' and value.isdigit() and int(value) > 0:
+            segment['active_days'] = int(value)
+        elif name in ('premium', 'nonpremium') and not value:
+            if segment.get('premium') == (name == 'nonpremium'):
+                raise ValueError("premium and nonpremium can't be combined")
+            segment['premium'] = name == 'premium'
+        elif name == 'username' and value:
+            segment['username_prefix'] = value.lstrip('@')
+        else:
+            raise ValueError(f"unknown filter {arg!r}")
+    return segment
+
+def describe_segment(segment):
+    parts = []
+    if 'active_days' in segment:
+        parts.append(f"active in the last {segment['active_days']} days")
+    if 'premium' in segment:
+        parts.append("premium" if segment['premium'] else "non-premium")
+    if 'username_prefix' in segment:
+        parts.append(f"username starts with {segment['username_prefix']}")
+    return ", ".join(parts) or "all users"
+
+SCHEDULE_USAGE = (
+    "Usage: /schedule <time>\n"
+    "• HH:MM - the next time the clock shows HH:MM\n"
+    "• YYYY-MM-DD HH:MM - that date and time\n"
+    "• +<n>m, +<n>h or +<n>d - minutes, hours or days from now\n"
+    "Times are in the bot's local time."
+)
+
+SCHEDULE_OFFSET_PATTERN = re.compile(r'^\+(\d+)([mhd])$')
+SCHEDULE_OFFSET_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+# Broadcast job states before the send starts
+SCHEDULED_STATES = ["scheduled", "preparing", "ready"]
+
+def parse_schedule_time(args, now: datetime = None):
+    # /schedule argument -> send time (naive local time like every stored date); ValueError if invalid
+    now = now or datetime.now()
+    text = " ".join(args).strip()
+    if not text:
+        raise ValueError("missing time")
+    
+    offset = SCHEDULE_OFFSET_PATTERN.match(text)
+    if offset:
+        run_at = now + timedelta(**{SCHEDULE_OFFSET_UNITS[offset.group(2)]: int(offset.group(1))})
+    else:
+        try:
+            run_at = datetime.strptime(text, "%Y-%m-%d %H:%M")
+        except ValueError:
+            try:
+                clock = datetime.strptime(text, "%H:%M")
+            except ValueError:
+                raise ValueError(f"can't read time {text!r}") from None
+            run_at = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+            if run_at <= now:
+                run_at += timedelta(days=1)
+    
+    if run_at <= now:
+        raise ValueError("that time has already passed")
+    return run_at
+
+# User id in the header of messages forwarded to the admin (routes older than the index)
+USER_ID_PATTERN = re.compile(r'ID: (\d+)')
+
+def is_active_member(member):
+    if member.status in [ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
+        return True
+    return member.status == ChatMember.RESTRICTED and getattr(member, 'is_member', False)
+
+class RateLimiter:
+    # Global token bucket shared by every bulk send so we never exceed Telegram's ceiling.
+    # The rate adapts AIMD-style: halved on flood control, raised slowly on success.
+    def __init__(self, rate: float, burst: float = 1, min_rate: float = 1, increase: float = 1):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.increase = increase
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def on_success(self):
+        # Additive increase: about `increase` msg/s more for every second of clean sending
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+    
+    def on_flood(self, retry_after: float):
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + retry_after)
+        
+        # Multiplicative decrease, once per flood window even if many sends hit the 429
+        if now - self.last_decrease >= retry_after:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.last_decrease = now
+            logger.warning(f"Flood control hit, broadcast rate lowered to {self.rate:.1f} msg/s for {retry_after}s")
+
+class SharedRateBudget:
+    # Per-second send budget shared through MongoDB by every process broadcasting with the
+    # same token. Tokens are reserved in blocks so most sends never touch the database.
+    def __init__(self, collection, rate: int, block: int = None):
+        self.collection = collection
+        self.rate = rate
+        self.block = block or max(1, rate // 10)
+        self.window = None
+        self.granted = 0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                window = int(time.time())
+                if window == self.window and self.granted > 0:
+                    self.granted -= 1
+                    return
+                
+                result = await self.collection.find_one_and_update(
+                    {"_id": window},
+                    {
+                        "$inc": {"used": self.block},
+                        "$setOnInsert": {"expires": datetime.utcnow() + timedelta(minutes=1)}
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                granted = min(self.block, self.rate - (result['used'] - self.block))
+                if granted > 0:
+                    self.window = window
+                    self.granted = granted - 1
+                    return
+                
+                # This second's budget is used up by the other processes
+                await asyncio.sleep(max(0, window + 1 - time.time()))
+
+class BroadcastEngine:
+    # Sends to many recipients with bounded concurrency, every API call paced by the limiter
+    def __init__(self, limiter: RateLimiter, concurrency: int, max_retries: int = 3, budget: SharedRateBudget = None):
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.budget = budget
+        self.queues = set()
+    
+    @property
+    def queue_depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+    
+    async def attempt(self, method, **kwargs):
+        name = getattr(method, '__name__', 'unknown')
+        SEND_ATTEMPTS.inc(name)
+        started = time.monotonic()
+        try:
+            result = await method(**kwargs)
+        except Exception as e:
+            SEND_RESULTS.inc(name, type(e).__name__)
+            raise
+        SEND_SECONDS.observe(time.monotonic() - started, name)
+        SEND_RESULTS.inc(name, "ok")
+        return result
+    
+    async def call(self, method, **kwargs):
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            if self.budget:
+                await self.budget.acquire()
+            try:
+                result = await self.attempt(method, **kwargs)
+            except RetryAfter as e:
+                # Flood control: slow everyone down and retry this send after the wait
+                self.limiter.on_flood(e.retry_after)
+                if attempt >= self.max_retries:
+                    raise
+            except BadRequest:
+                raise
+            except NetworkError:
+                # Transient network error (includes TimedOut): jittered exponential backoff
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.5))
+            else:
+                self.limiter.on_success()
+                return result
+            
+            attempt += 1
+    
+    async def run(self, recipients, send):
+        # recipients may be a plain or an async iterable of chat ids
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self.queues.add(queue)
+        counts = {'successful': 0, 'failed': 0}
+        
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    await send(chat_id)
+                    counts['successful'] += 1
+                except Exception as e:
+                    logger.error(f"Failed to send broadcast to user {chat_id}: {e}")
+                    counts['failed'] += 1
+                finally:
+                    queue.task_done()
+        
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(recipients, '__aiter__'):
+                async for chat_id in recipients:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in recipients:
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            self.queues.discard(queue)
+            for task in workers:
+                task.cancel()
+        
+        return counts['successful'], counts['failed']
+
+class TTLCache:
+    # Small dict cache whose entries expire after `ttl` seconds
+    def __init__(self, ttl: float, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        
+        value, expires = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        return value
+    
+    def set(self, key, value):
+        now = time.monotonic()
+        if len(self.entries) >= self.max_entries:
+            self.entries = {k: entry for k, entry in self.entries.items() if entry[1] >= now}
+            if len(self.entries) >= self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = (value, now + self.ttl)
+    
+    def clear(self):
+        self.entries.clear()
+
+class AsyncCollection:
+    # Runs pymongo calls on a dedicated thread pool so handlers never block the event loop
+    def __init__(self, collection, executor: ThreadPoolExecutor):
+        self.collection = collection
+        self.executor = executor
+    
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            MONGO_SECONDS.observe(time.monotonic() - started, self.collection.name, func.__name__)
+    
+    async def find(self, *args, **kwargs):
+        def find():
+            return list(self.collection.find(*args, **kwargs))
+        return await self.run(find)
+    
+    async def iter_batches(self, filter, projection=None, batch_size: int = 1000):
+        # Stream a server-side cursor batch by batch instead of materializing every document
+        cursor = self.collection.find(filter, projection, batch_size=batch_size)
+        
+        def find_batch():
+            return list(itertools.islice(cursor, batch_size))
+        
+        try:
+            while True:
+                batch = await self.run(find_batch)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            self.executor.submit(cursor.close)
+    
+    async def find_one(self, *args, **kwargs):
+        return await self.run(self.collection.find_one, *args, **kwargs)
+    
+    async def insert_one(self, *args, **kwargs):
+        return await self.run(self.collection.insert_one, *args, **kwargs)
+    
+    async def update_one(self, *args, **kwargs):
+        return await self.run(self.collection.update_one, *args, **kwargs)
+    
+    async def update_many(self, *args, **kwargs):
+        return await self.run(self.collection.update_many, *args, **kwargs)
+    
+    async def find_one_and_update(self, *args, **kwargs):
+        return await self.run(self.collection.find_one_and_update, *args, **kwargs)
+    
+    async def delete_one(self, *args, **kwargs):
+        return await self.run(self.collection.delete_one, *args, **kwargs)
+    
+    async def insert_many(self, *args, **kwargs):
+        return await self.run(self.collection.insert_many, *args, **kwargs)
+    
+    async def delete_many(self, *args, **kwargs):
+        return await self.run(self.collection.delete_many, *args, **kwargs)
+    
+    async def count_documents(self, *args, **kwargs):
+        return await self.run(self.collection.count_documents, *args, **kwargs)
+    
+    async def aggregate(self, *args, **kwargs):
+        def aggregate():
+            return list(self.collection.aggregate(*args, **kwargs))
+        return await self.run(aggregate)
+    
+    async def bulk_write(self, *args, **kwargs):
+        return await self.run(self.collection.bulk_write, *args, **kwargs)
+
+class MembershipCache:
+    # In-memory mirror of the user ids stored in a collection (banned / premium)
+    def __init__(self, collection: AsyncCollection):
+        self.collection = collection
+        self.ids = set()
+    
+    async def load(self):
+        docs = await self.collection.find({}, {"user_id": 1, "_id": 0})
+        self.ids = {doc['user_id'] for doc in docs}
+        return len(self.ids)
+    
+    def add(self, user_id: int):
+        self.ids.add(user_id)
+    
+    def discard(self, user_id: int):
+        self.ids.discard(user_id)
+    
+    def __contains__(self, user_id):
+        return user_id in self.ids
+    
+    def __len__(self):
+        return len(self.ids)
+
+class WriteBehindBuffer:
+    # Coalesces last_seen upserts per user and writes them in a single bulk_write
+    def __init__(self, collection: AsyncCollection, max_entries: int, on_flush=None):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.on_flush = on_flush
+        self.pending = {}
+        self.lock = asyncio.Lock()
+    
+    async def add(self, user_id: int, username: str):
+        self.pending[user_id] = (username, datetime.now())
+        
+        # Flush early when the buffer fills up, unless a flush is already running
+        if len(self.pending) >= self.max_entries and not self.lock.locked():
+            await self.flush()
+    
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return None
+            
+            pending, self.pending = self.pending, {}
+            requests = [
+                UpdateOne(
+                    {"user_id": user_id},
+                    {
+                        "$set": {
+                            "user_id": user_id,
+                            "username": username,
+                            "last_seen": last_seen
+                        }
+                    },
+                    upsert=True
+                )
+                for user_id, (username, last_seen) in pending.items()
+            ]
+            
+            try:
+                result = await self.collection.bulk_write(requests, ordered=False)
+            except Exception:
+                # Keep the entries for the next flush unless newer ones arrived meanwhile
+                for user_id, entry in pending.items():
+                    self.pending.setdefault(user_id, entry)
+                raise
+            
+            if self.on_flush:
+                await self.on_flush(result)
+            return result
+
+class ChannelMemberIndex:
+    # Premium channel membership learned from chat_member updates, mirrored in MongoDB
+    def __init__(self, collection: AsyncCollection):
+        self.collection = collection
+        self.members = {}
+    
+    async def load(self):
+        members = {}
+        async for batch in self.collection.iter_batches({}, {"_id": 0, "channel_id": 1, "user_id": 1, "is_member": 1}):
+            for doc in batch:
+                members[(doc['channel_id'], doc['user_id'])] = doc['is_member']
+        self.members = members
+        return len(members)
+    
+    def get(self, channel_id, user_id: int):
+        # True / False when an update was seen for this user, None when unknown
+        return self.members.get((channel_id, user_id))
+    
+    async def record(self, channel_id, user_id: int, is_member: bool, status: str):
+        self.members[(channel_id, user_id)] = is_member
+        await self.collection.update_one(
+            {"channel_id": channel_id, "user_id": user_id},
+            {"$set": {"is_member": is_member, "status": status, "updated_date": datetime.now()}},
+            upsert=True
+        )
+    
+    async def forget_channel(self, channel_id):
+        self.members = {key: value for key, value in self.members.items() if key[0] != channel_id}
+        await self.collection.delete_many({"channel_id": channel_id})
+
+class MessageRouteIndex:
+    # Which user a message in the admin chat was forwarded from, so replies can be routed.
+    # Recent routes are kept in an LRU in front of the TTL-indexed collection.
+    def __init__(self, collection: AsyncCollection, ttl: timedelta, max_entries: int = 10000):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.routes = OrderedDict()
+    
+    def remember(self, message_id: int, user_id: int):
+        self.routes[message_id] = user_id
+        self.routes.move_to_end(message_id)
+        if len(self.routes) > self.max_entries:
+            self.routes.popitem(last=False)
+    
+    async def record(self, message_id: int, user_id: int):
+        self.remember(message_id, user_id)
+        await self.collection.update_one(
+            {"message_id": message_id},
+            {"$set": {"user_id": user_id, "expires": datetime.utcnow() + self.ttl}},
+            upsert=True
+        )
+    
+    async def lookup(self, message_id: int):
+        user_id = self.routes.get(message_id)
+        if user_id is not None:
+            self.routes.move_to_end(message_id)
+            return user_id
+        
+        # Forwarded by another process, or pushed out of the LRU
+        route = await self.collection.find_one({"message_id": message_id}, {"_id": 0, "user_id": 1})
+        if route:
+            self.remember(message_id, route['user_id'])
+            return route['user_id']
+        return None
+
+class InviteLinkPool:
+    # Pre-created single-use invite links per premium channel, handed out from memory
+    def __init__(self, size: int, low_water: int, lifetime: timedelta = timedelta(hours=2),
+                 min_remaining: timedelta = timedelta(hours=1)):
+        self.size = size
+        self.low_water = low_water
+        self.lifetime = lifetime
+        self.min_remaining = min_remaining
+        self.links = {}
+    
+    def take(self, channel_id):
+        pool = self.links.get(channel_id)
+        now = datetime.now()
+        
+        while pool:
+            invite_link, expire_date = pool.popleft()
+            if expire_date - now >= self.min_remaining:
+                return invite_link
+        return None
+    
+    def discard_expired(self, channel_ids):
+        # Drop removed channels and links that would not stay valid long enough
+        cutoff = datetime.now() + self.min_remaining
+        self.links = {
+            channel_id: deque(entry for entry in self.links.get(channel_id, ()) if entry[1] >= cutoff)
+            for channel_id in channel_ids
+        }
+    
+    async def refill(self, channel_id, create_link):
+        pool = self.links.setdefault(channel_id, deque())
+        if len(pool) >= self.low_water:
+            return 0
+        
+        created = 0
+        while len(pool) < self.size:
+            expire_date = datetime.now() + self.lifetime
+            invite_link = await create_link(chat_id=channel_id, member_limit=1, expire_date=expire_date)
+            pool.append((invite_link.invite_link, expire_date))
+            created += 1
+        return created
 
 class PremiumBot:
     def __init__(self):
         self.bot_token = os.getenv('BOT_TOKEN')
         self.mongodb_url = os.getenv('MONGODB_URL')
         self.admin_id = int(os.getenv('ADMIN_ID', '0'))
+        self.api_url = os.getenv('TELEGRAM_API_URL')
+        
+        # Webhook mode is used instead of long polling when WEBHOOK_URL is set
+        self.webhook_url = os.getenv('WEBHOOK_URL')
+        self.webhook_listen = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+        self.webhook_port = int(os.getenv('WEBHOOK_PORT', '8443'))
+        self.webhook_path = os.getenv('WEBHOOK_PATH', 'telegram')
+        self.webhook_secret = os.getenv('WEBHOOK_SECRET')
+        self.webhook_max_connections = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+        
+        # Updates of different chats are handled concurrently, 0 to handle them one by one
+        self.concurrent_updates = int(os.getenv('CONCURRENT_UPDATES', '32'))
+        
+        # Multi-process mode: a front process hands updates to this many worker processes
+        self.update_workers = int(os.getenv('UPDATE_WORKERS', '0'))
+        self.primary = True
+        self.peer_events = None
+        
+        # Prometheus metrics endpoint, off unless a port is given
+        self.metrics_port = int(os.getenv('METRICS_PORT', '0'))
+        self.metrics_server = None
+        
+        # Broadcast engine (Telegram allows roughly 30 bulk messages per second)
+        self.broadcaster = BroadcastEngine(
+            RateLimiter(float(os.getenv('BROADCAST_RATE', '30'))),
+            int(os.getenv('BROADCAST_CONCURRENCY', '25')),
+            int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+        )
+        self.broadcast_chunk_size = int(os.getenv('BROADCAST_CHUNK_SIZE', '500'))
+        
+        # Chunks are leased so any number of processes can work on the same broadcast
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.broadcast_lease = timedelta(seconds=int(os.getenv('BROADCAST_LEASE_SECONDS', '60')))
+        self.broadcast_poll_interval = float(os.getenv('BROADCAST_POLL_SECONDS', '2'))
+        self.broadcast_workers = int(os.getenv('BROADCAST_WORKERS', '0'))
+        
+        # The shared budget costs a MongoDB round trip every few sends, so it is only on by
+        # default when this bot runs several sending processes of its own
+        several_processes = self.broadcast_workers > 0 or self.update_workers > 0
+        default_global_rate = os.getenv('BROADCAST_RATE', '30') if several_processes else '0'
+        self.global_rate = round(float(os.getenv('BROADCAST_GLOBAL_RATE', default_global_rate)))
+        self.active_jobs = set()
+        self.background_tasks = set()
+        
+        # Broadcasts run in the background, one at a time in the order the admin sent them
+        self.broadcast_order = asyncio.Lock()
+        self.profiling = False
+        self.pending_albums = {}
+        
+        # Scheduled broadcasts snapshot their audience this long before the send time
+        self.schedule_snapshot_lead = int(os.getenv('SCHEDULE_SNAPSHOT_LEAD_SECONDS', '300'))
+        self.scheduled_snapshots = {}
+        self.album_wait = 1.5
         
-        # MongoDB setup
+        # "Wait for reply" notices are deleted by one drain task, only running while any are queued
+        self.pending_deletions = deque()
+        self.deletion_task = None
+        self.wait_message_delay = 0.5
+        
+        # MongoDB setup (blocking driver calls run on their own thread pool)
         try:
-            self.client = MongoClient(self.mongodb_url)
+            pool_size = int(os.getenv('MONGODB_POOL_SIZE', '16'))
+            self.client = MongoClient(self.mongodb_url, maxPoolSize=pool_size)
             self.db = self.client.premium_bot
-            self.premium_users = self.db.premium_users
-            self.broadcast_logs = self.db.broadcast_logs
-            self.premium_channels = self.db.premium_channels
-            self.banned_users = self.db.banned_users
-            self.all_users = self.db.all_users
+            self.db_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="mongo")
+            self.premium_users = AsyncCollection(self.db.premium_users, self.db_executor)
+            self.broadcast_logs = AsyncCollection(self.db.broadcast_logs, self.db_executor)
+            self.premium_channels = AsyncCollection(self.db.premium_channels, self.db_executor)
+            self.banned_users = AsyncCollection(self.db.banned_users, self.db_executor)
+            self.all_users = AsyncCollection(self.db.all_users, self.db_executor)
+            self.broadcast_jobs = AsyncCollection(self.db.broadcast_jobs, self.db_executor)
+            self.broadcast_chunks = AsyncCollection(self.db.broadcast_chunks, self.db_executor)
+            self.counters = AsyncCollection(self.db.counters, self.db_executor)
+            self.channel_members = AsyncCollection(self.db.channel_members, self.db_executor)
+            self.rate_budget = AsyncCollection(self.db.rate_budget, self.db_executor)
+            self.message_routes = AsyncCollection(self.db.message_routes, self.db_executor)
+            self.counters_reconcile = int(os.getenv('COUNTERS_RECONCILE_SECONDS', '3600'))
+            
+            # All broadcasting processes share one send rate
+            if self.global_rate > 0:
+                self.broadcaster.budget = SharedRateBudget(self.rate_budget, self.global_rate)
+            
+            # Hot-path membership checks are answered from memory
+            self.banned_ids = MembershipCache(self.banned_users)
+            self.premium_ids = MembershipCache(self.premium_users)
+            self.membership_refresh = int(os.getenv('MEMBERSHIP_REFRESH_SECONDS', '300'))
+            
+            # Premium channels and (channel, user) membership results
+            self.channels = None
+            self.member_cache = TTLCache(int(os.getenv('MEMBER_CACHE_SECONDS', '300')))
+            self.member_index = ChannelMemberIndex(self.channel_members)
+            
+            # Admin chat message -> user it came from, for routing admin replies
+            self.route_index = MessageRouteIndex(
+                self.message_routes,
+                timedelta(days=int(os.getenv('MESSAGE_ROUTE_DAYS', '30'))),
+                int(os.getenv('MESSAGE_ROUTE_CACHE', '10000'))
+            )
+            
+            # Invite links are created ahead of time by a background job
+            self.invite_pool = InviteLinkPool(
+                int(os.getenv('INVITE_POOL_SIZE', '10')),
+                int(os.getenv('INVITE_POOL_LOW_WATER', '3'))
+            )
+            self.invite_pool_interval = int(os.getenv('INVITE_POOL_REFRESH_SECONDS', '300'))
+            
+            # Admin list commands, paged by their indexed key
+            self.list_page_size = int(os.getenv('LIST_PAGE_SIZE', '20'))
+            self.list_views = {
+                'premium': {
+                    'collection': self.premium_users,
+                    'key': 'user_id',
+                    'projection': {"_id": 0, "user_id": 1, "added_date": 1},
+                    'title': "💎 Premium Users List:\n\n",
+                    'empty': "📋 No premium users found!",
+                    'format': lambda i, user: f"{i}. User ID: {user['user_id']} (Added: {user['added_date'].strftime('%Y-%m-%d %H:%M')})\n"
+                },
+                'banned': {
+                    'collection': self.banned_users,
+                    'key': 'user_id',
+                    'projection': {"_id": 0, "user_id": 1, "banned_date": 1},
+                    'title': "🚫 Banned Users List:\n\n",
+                    'empty': "📋 No banned users found!",
+                    'format': lambda i, user: f"{i}. User ID: {user['user_id']} (Banned: {user['banned_date'].strftime('%Y-%m-%d %H:%M')})\n"
+                },
+                'channels': {
+                    'collection': self.premium_channels,
+                    'key': 'channel_id',
+                    'projection': {"_id": 0, "channel_id": 1, "channel_name": 1, "added_date": 1},
+                    'title': "📺 Premium Channels List:\n\n",
+                    'empty': "📋 No premium channels found!",
+                    'format': lambda i, channel: f"{i}. {channel['channel_name']}\n   ID: {channel['channel_id']}\n   Added: {channel['added_date'].strftime('%Y-%m-%d %H:%M')}\n\n"
+                }
+            }
+            
+            # last_seen updates are buffered and written in batches
+            self.user_writes = WriteBehindBuffer(
+                self.all_users,
+                int(os.getenv('USER_FLUSH_BATCH', '500')),
+                on_flush=self.count_new_users
+            )
+            self.user_flush_interval = int(os.getenv('USER_FLUSH_INTERVAL_MS', '1000')) / 1000
+            
+            METRICS.gauge("bot_broadcast_rate", "Current adaptive broadcast rate in messages per second", lambda: self.broadcaster.limiter.rate)
+            METRICS.gauge("bot_broadcast_queue_depth", "Recipients queued for the broadcast send workers", lambda: self.broadcaster.queue_depth)
+            METRICS.gauge("bot_broadcast_active_jobs", "Broadcast jobs this process is working on", lambda: len(self.active_jobs))
+            METRICS.gauge("bot_user_writes_pending", "Buffered user updates not yet written to MongoDB", lambda: len(self.user_writes.pending))
             logger.info("Connected to MongoDB successfully")
         except ConnectionFailure:
             logger.error("Failed to connect to MongoDB")
             
-    def is_banned_user(self, user_id):
+    async def post_init(self, application: Application):
+        if self.metrics_port:
+            METRICS.gauge("bot_update_queue_depth", "Updates received but not yet handled", application.update_queue.qsize)
+            self.metrics_server = start_metrics_server(self.metrics_port)
+        
+        # Only the primary process (worker 0 in multi-process mode) runs migrations
+        if self.primary:
+            loop = asyncio.get_running_loop()
+            version = await loop.run_in_executor(self.db_executor, run_migrations, self.db)
+            logger.info(f"Database schema at version {version}")
+        
+        await self.load_membership()
+        
+        member_count = await self.member_index.load()
+        logger.info(f"Loaded {member_count} channel membership records")
+        
+        if application.job_queue and self.invite_pool.size > 0:
+            application.job_queue.run_repeating(
+                self.refill_invite_pool_job,
+                interval=self.invite_pool_interval,
+                first=1
+            )
+        
+        if self.primary:
+            # Build the stats counters on first start, then correct drift periodically
+            if not await self.counters.find_one({"_id": "totals"}):
+                await self.reconcile_counters()
+            
+            if application.job_queue and self.counters_reconcile > 0:
+                application.job_queue.run_repeating(
+                    self.reconcile_counters_job,
+                    interval=self.counters_reconcile,
+                    first=self.counters_reconcile
+                )
+            
+            # Resume broadcasts interrupted by a restart
+            unfinished_jobs = await self.broadcast_jobs.find({"status": {"$in": ["snapshot", "running", "finishing"]}})
+            for job in unfinished_jobs:
+                self.start_background_task(self.resume_broadcast_job(application.bot, job))
+            
+            # Scheduled broadcasts only live in the job queue, so they are queued again
+            scheduled_jobs = await self.broadcast_jobs.find({"status": {"$in": SCHEDULED_STATES}})
+            for job in scheduled_jobs:
+                if application.job_queue:
+                    self.schedule_broadcast_job(application.job_queue, job)
+                else:
+                    logger.warning(f"No job queue, scheduled broadcast job {job['_id']} won't be sent")
+            if scheduled_jobs:
+                logger.info(f"Queued {len(scheduled_jobs)} scheduled broadcasts")
+        
+        # Pick up edits made by other processes
+        if application.job_queue and self.membership_refresh > 0:
+            application.job_queue.run_repeating(
+                self.refresh_membership_job,
+                interval=self.membership_refresh,
+                first=self.membership_refresh
+            )
+        
+        if application.job_queue:
+            application.job_queue.run_repeating(
+                self.flush_users_job,
+                interval=self.user_flush_interval,
+                first=self.user_flush_interval
+            )
+    
+    async def post_shutdown(self, application: Application):
+        # Interrupted broadcasts resume from their last checkpoint on the next start
+        tasks = list(self.background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+        if self.metrics_server:
+            self.metrics_server.stop()
+        
         try:
-            user = self.banned_users.find_one({"user_id": user_id})
-            return user is not None
+            await self.user_writes.flush()
+            logger.info("Flushed pending user updates")
         except Exception as e:
-            logger.error(f"Error checking ban status: {e}")
-            return False
+            logger.error(f"Error flushing user updates on shutdown: {e}")
     
-    def save_user(self, user_id, username):
+    def start_background_task(self, coro):
+        # Work that outlives a single update; tracked so it can be cancelled on shutdown
+        task = asyncio.get_running_loop().create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    async def flush_users_job(self, context: ContextTypes.DEFAULT_TYPE):
         try:
-            self.all_users.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {
-                        "user_id": user_id,
-                        "username": username,
-                        "last_seen": datetime.now()
-                    }
-                },
-                upsert=True
-            )
+            await self.user_writes.flush()
+        except Exception as e:
+            logger.error(f"Error flushing user updates: {e}")
+    
+    async def load_membership(self):
+        banned_count, premium_count = await asyncio.gather(
+            self.banned_ids.load(),
+            self.premium_ids.load()
+        )
+        logger.info(f"Loaded membership cache - Banned: {banned_count}, Premium: {premium_count}")
+    
+    async def refresh_membership_job(self, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            self.channels = None
+            await self.load_membership()
+        except Exception as e:
+            logger.error(f"Error refreshing membership cache: {e}")
+    
+    async def increment_counter(self, field: str, amount: int = 1, counter_id: str = "totals"):
+        try:
+            await self.counters.update_one({"_id": counter_id}, {"$inc": {field: amount}}, upsert=True)
+        except Exception as e:
+            logger.error(f"Error updating counter {counter_id}.{field}: {e}")
+    
+    async def count_new_users(self, result):
+        if result.upserted_count:
+            await self.increment_counter("total_users", result.upserted_count)
+    
+    async def reconcile_counters(self):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        total_users, premium_users, banned_users, premium_channels, broadcasts_today = await asyncio.gather(
+            self.all_users.count_documents({}),
+            self.premium_users.count_documents({}),
+            self.banned_users.count_documents({}),
+            self.premium_channels.count_documents({}),
+            self.broadcast_logs.count_documents({"timestamp": {"$gte": today}})
+        )
+        
+        await self.counters.update_one(
+            {"_id": "totals"},
+            {
+                "$set": {
+                    "total_users": total_users,
+                    "premium_users": premium_users,
+                    "banned_users": banned_users,
+                    "premium_channels": premium_channels,
+                    "reconciled_date": datetime.now()
+                }
+            },
+            upsert=True
+        )
+        await self.counters.update_one(
+            {"_id": f"broadcasts:{today.strftime('%Y-%m-%d')}"},
+            {"$set": {"count": broadcasts_today}},
+            upsert=True
+        )
+        logger.info("Reconciled stats counters")
+    
+    async def reconcile_counters_job(self, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await self.reconcile_counters()
+        except Exception as e:
+            logger.error(f"Error reconciling stats counters: {e}")
+    
+    async def read_counters(self):
+        # Totals and today's broadcast count in a single query
+        broadcasts_id = f"broadcasts:{datetime.now().strftime('%Y-%m-%d')}"
+        docs = await self.counters.find({"_id": {"$in": ["totals", broadcasts_id]}})
+        counters = {doc['_id']: doc for doc in docs}
+        
+        totals = counters.get("totals", {})
+        return {
+            "total_users": totals.get("total_users", 0),
+            "premium_users": totals.get("premium_users", 0),
+            "banned_users": totals.get("banned_users", 0),
+            "premium_channels": totals.get("premium_channels", 0),
+            "broadcasts_today": counters.get(broadcasts_id, {}).get("count", 0)
+        }
+    
+    def set_membership(self, kind: str, user_id: int, present: bool):
+        # Update the local cache and tell the other worker processes
+        cache = self.banned_ids if kind == 'banned' else self.premium_ids
+        if present:
+            cache.add(user_id)
+        else:
+            cache.discard(user_id)
+        self.publish_event({"type": kind, "user_id": user_id, "present": present})
+    
+    def invalidate_channels(self):
+        self.channels = None
+        self.publish_event({"type": "channels"})
+    
+    def publish_event(self, event: dict):
+        if self.peer_events is not None:
+            self.peer_events.put(event)
+    
+    def apply_peer_event(self, event: dict):
+        if event['type'] == 'channels':
+            self.channels = None
+            return
+        
+        cache = self.banned_ids if event['type'] == 'banned' else self.premium_ids
+        if event['present']:
+            cache.add(event['user_id'])
+        else:
+            cache.discard(event['user_id'])
+    
+    def is_banned_user(self, user_id):
+        return user_id in self.banned_ids
+    
+    def audience_query(self, segment: dict = None):
+        # Non-banned users, narrowed by the segment; every condition is on an indexed field
+        segment = segment or {}
+        query = {}
+        user_ids = {}
+        
+        if len(self.banned_ids):
+            user_ids['$nin'] = list(self.banned_ids.ids)
+        if segment.get('premium') is True:
+            user_ids['$in'] = list(self.premium_ids.ids)
+        elif segment.get('premium') is False and len(self.premium_ids):
+            user_ids['$nin'] = user_ids.get('$nin', []) + list(self.premium_ids.ids)
+        if user_ids:
+            query['user_id'] = user_ids
+        
+        if 'active_days' in segment:
+            query['last_seen'] = {"$gte": datetime.now() - timedelta(days=segment['active_days'])}
+        if 'username_prefix' in segment:
+            # An anchored, case-sensitive prefix is answered from the username index
+            query['username'] = {"$regex": f"^{re.escape(segment['username_prefix'])}"}
+        
+        return query
+    
+    async def iter_audience(self, segment: dict = None):
+        # Non-banned user ids straight from a server-side cursor, filtered by MongoDB
+        query = self.audience_query(segment)
+        async for batch in self.all_users.iter_batches(query, {"user_id": 1, "_id": 0}):
+            for user in batch:
+                yield user['user_id']
+    
+    async def save_user(self, user_id, username):
+        try:
+            await self.user_writes.add(user_id, username)
         except Exception as e:
             logger.error(f"Error saving user: {e}")
             
@@ -67,7 +1296,7 @@ class PremiumBot:
             return
         
         # Save user to database (auto-save for broadcast purposes)
-        self.save_user(user_id, username)
+        await self.save_user(user_id, username)
         
         # Check if user is premium
         is_premium = self.is_premium_user(user_id)
@@ -97,37 +1326,105 @@ class PremiumBot:
             )
             await update.message.reply_text(welcome_message, reply_markup=reply_markup)
     
-    async def check_and_invite_to_channels(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    async def get_channels(self):
+        # Premium channel list, cached until add_channel/remove_channel or the periodic refresh
+        if self.channels is None:
+            self.channels = await self.premium_channels.find({}, {"_id": 0, "channel_id": 1, "channel_name": 1})
+        return self.channels
+    
+    async def is_channel_member(self, bot, channel_id, user_id: int):
+        # Local index from chat_member updates first, then a cached API check
+        indexed = self.member_index.get(channel_id, user_id)
+        if indexed is not None:
+            return indexed
+        
+        cached = self.member_cache.get((channel_id, user_id))
+        if cached is not None:
+            return cached
+        
+        member = await self.broadcaster.call(bot.get_chat_member, chat_id=channel_id, user_id=user_id)
+        is_member = is_active_member(member)
+        self.member_cache.set((channel_id, user_id), is_member)
+        return is_member
+    
+    async def refill_invite_pool_job(self, context: ContextTypes.DEFAULT_TYPE):
         try:
-            channels = list(self.premium_channels.find())
+            channel_ids = [channel['channel_id'] for channel in await self.get_channels()]
+            self.invite_pool.discard_expired(channel_ids)
             
-            for channel in channels:
-                channel_id = channel['channel_id']
+            async def refill(channel_id):
                 try:
-                    # Check if user is already a member
-                    member = await context.bot.get_chat_member(channel_id, user_id)
-                    if member.status in ['member', 'administrator', 'creator']:
-                        continue  # User already in channel
-                        
-                    # Generate invite link for this user
-                    invite_link = await context.bot.create_chat_invite_link(
-                        chat_id=channel_id,
-                        member_limit=1,
-                        expire_date=datetime.now() + timedelta(hours=1)
-                    )
-                    
-                    invite_message = (
-                        f"🎉 You've been invited to premium channel!\n\n"
-                        f"Channel: {channel.get('channel_name', 'Premium Channel')}\n"
-                        f"Link: {invite_link.invite_link}\n\n"
-                        f"⚠️ This link expires in 1 hour and is for you only!"
-                    )
-                    
-                    await context.bot.send_message(chat_id=user_id, text=invite_message)
-                    logger.info(f"Sent invite link to user {user_id} for channel {channel_id}")
-                    
+                    create_link = functools.partial(self.broadcaster.call, context.bot.create_chat_invite_link)
+                    created = await self.invite_pool.refill(channel_id, create_link)
+                    if created:
+                        logger.info(f"Added {created} invite links to the pool for channel {channel_id}")
                 except Exception as e:
-                    logger.error(f"Error checking/inviting user {user_id} to channel {channel_id}: {e}")
+                    logger.error(f"Error refilling invite links for channel {channel_id}: {e}")
+            
+            await asyncio.gather(*(refill(channel_id) for channel_id in channel_ids))
+            
+        except Exception as e:
+            logger.error(f"Error refilling invite link pool: {e}")
+    
+    async def find_channel_id(self, chat):
+        # Map an incoming chat to the channel_id as stored in premium_channels
+        username = f"@{chat.username}".lower() if chat.username else None
+        for channel in await self.get_channels():
+            channel_id = channel['channel_id']
+            if channel_id == str(chat.id) or channel_id.lower() == username:
+                return channel_id
+        return None
+    
+    async def track_channel_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            chat_member = update.chat_member
+            channel_id = await self.find_channel_id(chat_member.chat)
+            if channel_id is None:
+                return
+            
+            new_member = chat_member.new_chat_member
+            await self.member_index.record(channel_id, new_member.user.id, is_active_member(new_member), new_member.status)
+            
+        except Exception as e:
+            logger.error(f"Error tracking channel member update: {e}")
+    
+    async def invite_to_channel(self, bot, channel, user_id: int):
+        channel_id = channel['channel_id']
+        try:
+            # Check if user is already a member
+            if await self.is_channel_member(bot, channel_id, user_id):
+                return  # User already in channel
+                
+            # Take a pre-generated link, or create one if the pool is empty
+            invite_link = self.invite_pool.take(channel_id)
+            if invite_link is None:
+                created_link = await self.broadcaster.call(
+                    bot.create_chat_invite_link,
+                    chat_id=channel_id,
+                    member_limit=1,
+                    expire_date=datetime.now() + timedelta(hours=1)
+                )
+                invite_link = created_link.invite_link
+            
+            invite_message = (
+                f"🎉 You've been invited to premium channel!\n\n"
+                f"Channel: {channel.get('channel_name', 'Premium Channel')}\n"
+                f"Link: {invite_link}\n\n"
+                f"⚠️ This link expires in 1 hour and is for you only!"
+            )
+            
+            await self.broadcaster.call(bot.send_message, chat_id=user_id, text=invite_message)
+            logger.info(f"Sent invite link to user {user_id} for channel {channel_id}")
+            
+        except Exception as e:
+            logger.error(f"Error checking/inviting user {user_id} to channel {channel_id}: {e}")
+    
+    async def check_and_invite_to_channels(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+        try:
+            channels = await self.get_channels()
+            
+            # All channels are checked concurrently, paced by the global limiter
+            await asyncio.gather(*(self.invite_to_channel(context.bot, channel, user_id) for channel in channels))
                     
         except Exception as e:
             logger.error(f"Error in check_and_invite_to_channels: {e}")
@@ -140,7 +1437,7 @@ class PremiumBot:
         username = query.from_user.username or "No username"
         
         # Auto-save user for broadcast purposes
-        self.save_user(user_id, username)
+        await self.save_user(user_id, username)
         
         is_premium = self.is_premium_user(user_id)
         
@@ -159,12 +1456,7 @@ class PremiumBot:
             await query.edit_message_text(contact_message)
     
     def is_premium_user(self, user_id):
-        try:
-            user = self.premium_users.find_one({"user_id": user_id})
-            return user is not None
-        except Exception as e:
-            logger.error(f"Error checking premium status: {e}")
-            return False
+        return user_id in self.premium_ids
     
     async def add_premium(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.id != self.admin_id:
@@ -178,20 +1470,22 @@ class PremiumBot:
         try:
             user_id = int(context.args[0])
             
-            # Check if user already exists
-            existing_user = self.premium_users.find_one({"user_id": user_id})
-            if existing_user:
-                await update.message.reply_text(f"User {user_id} is already a premium member!")
-                return
-                
-            # Add user to premium collection
+            # Add user to premium collection (the unique index rejects duplicates)
             premium_user = {
                 "user_id": user_id,
                 "added_date": datetime.now(),
                 "added_by": update.effective_user.id
             }
             
-            self.premium_users.insert_one(premium_user)
+            try:
+                await self.premium_users.insert_one(premium_user)
+            except DuplicateKeyError:
+                self.set_membership('premium', user_id, True)
+                await update.message.reply_text(f"User {user_id} is already a premium member!")
+                return
+            
+            self.set_membership('premium', user_id, True)
+            await self.increment_counter("premium_users")
             
             log_message = f"Admin added user {user_id} to premium members"
             logger.info(log_message)
@@ -222,9 +1516,11 @@ class PremiumBot:
         try:
             user_id = int(context.args[0])
             
-            result = self.premium_users.delete_one({"user_id": user_id})
+            result = await self.premium_users.delete_one({"user_id": user_id})
+            self.set_membership('premium', user_id, False)
             
             if result.deleted_count > 0:
+                await self.increment_counter("premium_users", -1)
                 log_message = f"Admin removed user {user_id} from premium members"
                 logger.info(log_message)
                 await update.message.reply_text(f"✅ User {user_id} has been removed from premium members!")
@@ -249,20 +1545,22 @@ class PremiumBot:
         try:
             user_id = int(context.args[0])
             
-            # Check if user already banned
-            existing_ban = self.banned_users.find_one({"user_id": user_id})
-            if existing_ban:
-                await update.message.reply_text(f"User {user_id} is already banned!")
-                return
-                
-            # Add user to banned collection
+            # Add user to banned collection (the unique index rejects duplicates)
             banned_user = {
                 "user_id": user_id,
                 "banned_date": datetime.now(),
                 "banned_by": update.effective_user.id
             }
             
-            self.banned_users.insert_one(banned_user)
+            try:
+                await self.banned_users.insert_one(banned_user)
+            except DuplicateKeyError:
+                self.set_membership('banned', user_id, True)
+                await update.message.reply_text(f"User {user_id} is already banned!")
+                return
+            
+            self.set_membership('banned', user_id, True)
+            await self.increment_counter("banned_users")
             
             log_message = f"Admin banned user {user_id}"
             logger.info(log_message)
@@ -287,9 +1585,11 @@ class PremiumBot:
         try:
             user_id = int(context.args[0])
             
-            result = self.banned_users.delete_one({"user_id": user_id})
+            result = await self.banned_users.delete_one({"user_id": user_id})
+            self.set_membership('banned', user_id, False)
             
             if result.deleted_count > 0:
+                await self.increment_counter("banned_users", -1)
                 log_message = f"Admin unbanned user {user_id}"
                 logger.info(log_message)
                 await update.message.reply_text(f"✅ User {user_id} has been unbanned!")
@@ -308,18 +1608,8 @@ class PremiumBot:
             return
             
         try:
-            banned_users = list(self.banned_users.find())
-            
-            if not banned_users:
-                await update.message.reply_text("📋 No banned users found!")
-                return
-                
-            message = "🚫 Banned Users List:\n\n"
-            for i, user in enumerate(banned_users, 1):
-                banned_date = user['banned_date'].strftime('%Y-%m-%d %H:%M')
-                message += f"{i}. User ID: {user['user_id']} (Banned: {banned_date})\n"
-                
-            await update.message.reply_text(message)
+            text, reply_markup = await self.render_list_page('banned')
+            await update.message.reply_text(text, reply_markup=reply_markup)
             
         except Exception as e:
             logger.error(f"Error listing banned users: {e}")
@@ -331,32 +1621,88 @@ class PremiumBot:
             return
             
         try:
-            premium_users = list(self.premium_users.find())
-            
-            if not premium_users:
-                await update.message.reply_text("📋 No premium users found!")
-                return
-                
-            message = "💎 Premium Users List:\n\n"
-            for i, user in enumerate(premium_users, 1):
-                added_date = user['added_date'].strftime('%Y-%m-%d %H:%M')
-                message += f"{i}. User ID: {user['user_id']} (Added: {added_date})\n"
-                
-            await update.message.reply_text(message)
+            text, reply_markup = await self.render_list_page('premium')
+            await update.message.reply_text(text, reply_markup=reply_markup)
             
         except Exception as e:
             logger.error(f"Error listing premium users: {e}")
             await update.message.reply_text(f"❌ Error fetching premium users: {str(e)}")
     
+    async def render_list_page(self, kind: str, direction: str = None, page: int = 0, key=None):
+        # Keyset pagination on an indexed key: every page is one bounded query
+        view = self.list_views[kind]
+        key_field = view['key']
+        
+        if direction == 'next':
+            query, order = {key_field: {"$gt": key}}, 1
+        elif direction == 'prev':
+            query, order = {key_field: {"$lt": key}}, -1
+        else:
+            query, order = {}, 1
+        
+        docs = await view['collection'].find(
+            query,
+            view['projection'],
+            sort=[(key_field, order)],
+            limit=self.list_page_size + 1
+        )
+        
+        has_more = len(docs) > self.list_page_size
+        docs = docs[:self.list_page_size]
+        
+        if direction == 'prev':
+            docs.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = direction == 'next', has_more
+        
+        if not docs:
+            return view['empty'], None
+        
+        start = page * self.list_page_size + 1
+        lines = [view['format'](i, doc) for i, doc in enumerate(docs, start)]
+        text = view['title'] + "".join(lines)
+        
+        buttons = []
+        if has_prev:
+            buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"list:{kind}:prev:{page - 1}:{docs[0][key_field]}"))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"list:{kind}:next:{page + 1}:{docs[-1][key_field]}"))
+        
+        reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+        return text, reply_markup
+    
+    async def list_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        
+        if query.from_user.id != self.admin_id:
+            await query.answer("❌ Only admin can use this command!")
+            return
+        
+        await query.answer()
+        
+        try:
+            _, kind, direction, page, key = query.data.split(":", 4)
+            if self.list_views[kind]['key'] == 'user_id':
+                key = int(key)
+            
+            text, reply_markup = await self.render_list_page(kind, direction, max(int(page), 0), key)
+            await query.edit_message_text(text, reply_markup=reply_markup)
+            
+        except Exception as e:
+            logger.error(f"Error paging list: {e}")
+            await query.edit_message_text(f"❌ Error fetching list: {str(e)}")
+    
     async def total_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.id != self.admin_id:
             await update.message.reply_text("❌ Only admin can use this command!")
             return
             
         try:
-            total_users = self.all_users.count_documents({})
-            premium_users = self.premium_users.count_documents({})
-            banned_users = self.banned_users.count_documents({})
+            counters = await self.read_counters()
+            total_users = counters['total_users']
+            premium_users = counters['premium_users']
+            banned_users = counters['banned_users']
             
             message = (
                 f"📊 User Statistics:\n\n"
@@ -390,7 +1736,7 @@ class PremiumBot:
                 channel_id = f"-{channel_id}"
             
             # Check if channel already exists
-            existing_channel = self.premium_channels.find_one({"channel_id": channel_id})
+            existing_channel = await self.premium_channels.find_one({"channel_id": channel_id})
             if existing_channel:
                 await update.message.reply_text(f"Channel {channel_id} is already in the premium channels list!")
                 return
@@ -410,7 +1756,14 @@ class PremiumBot:
                 "added_by": update.effective_user.id
             }
             
-            self.premium_channels.insert_one(premium_channel)
+            try:
+                await self.premium_channels.insert_one(premium_channel)
+            except DuplicateKeyError:
+                await update.message.reply_text(f"Channel {channel_id} is already in the premium channels list!")
+                return
+            
+            await self.increment_counter("premium_channels")
+            self.invalidate_channels()
             
             log_message = f"Admin added channel {channel_id} ({channel_name}) to premium channels"
             logger.info(log_message)
@@ -427,18 +1780,8 @@ class PremiumBot:
             return
             
         try:
-            channels = list(self.premium_channels.find())
-            
-            if not channels:
-                await update.message.reply_text("📋 No premium channels found!")
-                return
-                
-            message = "📺 Premium Channels List:\n\n"
-            for i, channel in enumerate(channels, 1):
-                added_date = channel['added_date'].strftime('%Y-%m-%d %H:%M')
-                message += f"{i}. {channel['channel_name']}\n   ID: {channel['channel_id']}\n   Added: {added_date}\n\n"
-                
-            await update.message.reply_text(message)
+            text, reply_markup = await self.render_list_page('channels')
+            await update.message.reply_text(text, reply_markup=reply_markup)
             
         except Exception as e:
             logger.error(f"Error listing premium channels: {e}")
@@ -460,9 +1803,12 @@ class PremiumBot:
             if not channel_id.startswith('-') and not channel_id.startswith('@'):
                 channel_id = f"-{channel_id}"
             
-            result = self.premium_channels.delete_one({"channel_id": channel_id})
+            result = await self.premium_channels.delete_one({"channel_id": channel_id})
             
             if result.deleted_count > 0:
+                await self.increment_counter("premium_channels", -1)
+                self.invalidate_channels()
+                await self.member_index.forget_channel(channel_id)
                 log_message = f"Admin removed channel {channel_id} from premium channels"
                 logger.info(log_message)
                 await update.message.reply_text(f"✅ Channel {channel_id} has been removed from premium channels!")
@@ -478,17 +1824,33 @@ class PremiumBot:
             await update.message.reply_text("❌ Only admin can use this command!")
             return
         
+        try:
+            segment = parse_segment(context.args or [])
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Invalid filter: {e}\n\n{SEGMENT_USAGE}")
+            return
+        
+        try:
+            estimate = await self.all_users.count_documents(self.audience_query(segment))
+        except Exception as e:
+            logger.error(f"Error estimating broadcast audience: {e}")
+            await update.message.reply_text(f"❌ Error estimating audience: {str(e)}")
+            return
+        
         # Initialize broadcast mode for admin
         context.user_data['broadcast_mode'] = True
         context.user_data['broadcast_messages'] = []
+        context.user_data['broadcast_segment'] = segment
         
         await update.message.reply_text(
             "📢 All Broadcast Mode Activated!\n\n"
-            "Send your messages now (text, photos, videos, documents).\n"
-            "When you're done, send /done to broadcast all messages to everyone."
+            f"🎯 Audience: {describe_segment(segment)}\n"
+            f"👥 Estimated recipients: {estimate}\n\n"
+            "Send your messages now (text, media, albums, stickers and more).\n"
+            "When you're done, send /done to broadcast all messages to this audience."
         )
         
-        logger.info("Admin activated all broadcast mode")
+        logger.info(f"Admin activated all broadcast mode for {describe_segment(segment)} (~{estimate} users)")
     
     async def done_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.id != self.admin_id:
@@ -499,87 +1861,202 @@ class PremiumBot:
             await update.message.reply_text("❌ No active broadcast session! Use /allbroadcast first.")
             return
         
-        broadcast_messages = context.user_data.get('broadcast_messages', [])
+        broadcast_messages = context.user_data.get('broadcast_messages', [])
+        
+        if not broadcast_messages:
+            await update.message.reply_text("❌ No messages to broadcast! Send some messages first.")
+            return
+        
+        segment = context.user_data.get('broadcast_segment') or {}
+        
+        # Clear broadcast mode
+        context.user_data['broadcast_mode'] = False
+        context.user_data['broadcast_messages'] = []
+        context.user_data.pop('broadcast_segment', None)
+        
+        # Runs in the background so other updates keep being handled meanwhile
+        self.start_background_task(self.all_broadcast(context.bot, update.effective_user.id, broadcast_messages, segment))
+    
+    async def all_broadcast(self, bot, admin_id: int, items: list, segment: dict = None):
+        async with self.broadcast_order:
+            await self.send_all_broadcast(bot, admin_id, items, segment)
+    
+    async def send_all_broadcast(self, bot, admin_id: int, items: list, segment: dict = None):
+        try:
+            # Persist the broadcast first so a restart resumes it instead of starting over
+            job = await self.create_broadcast_job('all', admin_id, "📢 Admin Broadcast:\n\n", items, segment)
+            
+            if not job['total_users']:
+                await self.discard_broadcast_job(job)
+                await bot.send_message(chat_id=admin_id, text="❌ No active users to broadcast to!")
+                return
+            
+            logger.info(f"Starting all broadcast to {job['total_users']} users ({describe_segment(job['segment'])}) with {len(items)} messages")
+            
+            # The summary is sent to the admin when the job finishes
+            await self.run_broadcast_job(bot, job)
+            
+        except Exception as e:
+            logger.error(f"Error during all broadcast: {e}")
+            await bot.send_message(chat_id=admin_id, text=f"❌ All broadcast failed: {str(e)}")
+    
+    async def schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user.id != self.admin_id:
+            await update.message.reply_text("❌ Only admin can use this command!")
+            return
+        
+        if not context.args:
+            await update.message.reply_text(f"{SCHEDULE_USAGE}\n\n{await self.render_scheduled_jobs()}")
+            return
+        
+        if not context.user_data.get('broadcast_mode'):
+            await update.message.reply_text("❌ No active broadcast session! Use /allbroadcast first.")
+            return
+        
+        broadcast_messages = context.user_data.get('broadcast_messages', [])
+        
+        if not broadcast_messages:
+            await update.message.reply_text("❌ No messages to broadcast! Send some messages first.")
+            return
+        
+        try:
+            run_at = parse_schedule_time(context.args)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Invalid time: {e}\n\n{SCHEDULE_USAGE}")
+            return
+        
+        if not context.job_queue:
+            await update.message.reply_text("❌ Scheduling needs the job queue, which isn't available!")
+            return
+        
+        segment = context.user_data.get('broadcast_segment') or {}
+        
+        try:
+            job = await self.create_broadcast_job(
+                'all', update.effective_user.id, "📢 Admin Broadcast:\n\n", broadcast_messages, segment, run_at=run_at
+            )
+            self.schedule_broadcast_job(context.job_queue, job)
+        except Exception as e:
+            logger.error(f"Error scheduling broadcast: {e}")
+            await update.message.reply_text(f"❌ Error scheduling broadcast: {str(e)}")
+            return
+        
+        # Clear broadcast mode
+        context.user_data['broadcast_mode'] = False
+        context.user_data['broadcast_messages'] = []
+        context.user_data.pop('broadcast_segment', None)
+        
+        await update.message.reply_text(
+            f"🗓 Broadcast scheduled for {run_at.strftime('%Y-%m-%d %H:%M')}\n"
+            f"🎯 Audience: {describe_segment(segment)}\n"
+            f"📩 Messages: {len(broadcast_messages)}\n\n"
+            f"Cancel it with /unschedule {job['_id']}"
+        )
+        logger.info(f"Admin scheduled broadcast job {job['_id']} for {run_at}")
+    
+    async def unschedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user.id != self.admin_id:
+            await update.message.reply_text("❌ Only admin can use this command!")
+            return
+        
+        try:
+            job_id = ObjectId(context.args[0])
+        except (IndexError, InvalidId):
+            await update.message.reply_text(f"❌ Usage: /unschedule <job_id>\n\n{await self.render_scheduled_jobs()}")
+            return
+        
+        # Only jobs that haven't started sending can be cancelled
+        result = await self.broadcast_jobs.delete_one({"_id": job_id, "status": {"$in": SCHEDULED_STATES}})
+        if not result.deleted_count:
+            await update.message.reply_text("❌ No scheduled broadcast with that id!")
+            return
+        
+        await self.broadcast_chunks.delete_many({"job_id": job_id})
+        if context.job_queue:
+            for queued in context.job_queue.get_jobs_by_name(f"scheduled-broadcast:{job_id}"):
+                queued.schedule_removal()
         
-        if not broadcast_messages:
-            await update.message.reply_text("❌ No messages to broadcast! Send some messages first.")
-            return
+        await update.message.reply_text(f"✅ Scheduled broadcast {job_id} cancelled!")
+        logger.info(f"Admin cancelled scheduled broadcast job {job_id}")
+    
+    async def render_scheduled_jobs(self):
+        jobs = await self.broadcast_jobs.find(
+            {"status": {"$in": SCHEDULED_STATES}},
+            {"payload": 0},
+            sort=[("run_at", 1)]
+        )
+        if not jobs:
+            return "📋 No scheduled broadcasts."
         
+        text = "🗓 Scheduled Broadcasts:\n\n"
+        for job in jobs:
+            text += (
+                f"{job['run_at'].strftime('%Y-%m-%d %H:%M')} - {describe_segment(job.get('segment') or {})}, "
+                f"{job['message_count']} messages\n   ID: {job['_id']}\n"
+            )
+        return text
+    
+    def schedule_broadcast_job(self, job_queue, job):
+        # Two job queue entries: the audience snapshot a little ahead of time, then the send
+        delay = max(0, (job['run_at'] - datetime.now()).total_seconds())
+        name = f"scheduled-broadcast:{job['_id']}"
+        job_queue.run_once(self.prepare_scheduled_job, when=max(0, delay - self.schedule_snapshot_lead), data=job['_id'], name=name)
+        job_queue.run_once(self.start_scheduled_job, when=delay, data=job['_id'], name=name)
+    
+    async def prepare_scheduled_job(self, context: ContextTypes.DEFAULT_TYPE):
+        job_id = context.job.data
+        self.scheduled_snapshots[job_id] = self.start_background_task(self.snapshot_scheduled_job(job_id))
+    
+    async def snapshot_scheduled_job(self, job_id):
         try:
-            all_users_list = list(self.all_users.find())
-            banned_users_list = list(self.banned_users.find())
-            banned_ids = {user['user_id'] for user in banned_users_list}
-            
-            # Filter out banned users
-            active_users = [user for user in all_users_list if user['user_id'] not in banned_ids]
-            
-            if not active_users:
-                await update.message.reply_text("❌ No active users to broadcast to!")
-                return
-            
-            successful_sends = 0
-            failed_sends = 0
-            
-            logger.info(f"Starting all broadcast to {len(active_users)} active users with {len(broadcast_messages)} messages")
-            
-            # Send all collected messages to all active users
-            for user in active_users:
-                user_success = True
-                try:
-                    for msg_data in broadcast_messages:
-                        if msg_data['type'] == 'text':
-                            await context.bot.send_message(
-                                chat_id=user['user_id'],
-                                text=f"📢 Admin Broadcast:\n\n{msg_data['content']}"
-                            )
-                        elif msg_data['type'] == 'photo':
-                            await context.bot.send_photo(
-                                chat_id=user['user_id'],
-                                photo=msg_data['file_id'],
-                                caption=f"📢 Admin Broadcast:\n\n{msg_data.get('caption', '')}"
-                            )
-                        elif msg_data['type'] == 'video':
-                            await context.bot.send_video(
-                                chat_id=user['user_id'],
-                                video=msg_data['file_id'],
-                                caption=f"📢 Admin Broadcast:\n\n{msg_data.get('caption', '')}"
-                            )
-                        elif msg_data['type'] == 'document':
-                            await context.bot.send_document(
-                                chat_id=user['user_id'],
-                                document=msg_data['file_id'],
-                                caption=f"📢 Admin Broadcast:\n\n{msg_data.get('caption', '')}"
-                            )
-                    
-                    if user_success:
-                        successful_sends += 1
-                        
-                except Exception as e:
-                    logger.error(f"Failed to send all broadcast messages to user {user['user_id']}: {e}")
-                    failed_sends += 1
-            
-            # Clear broadcast mode
-            context.user_data['broadcast_mode'] = False
-            context.user_data['broadcast_messages'] = []
-            
-            # Send summary to admin
-            summary = (
-                f"📊 All Broadcast Summary:\n"
-                f"✅ Successful: {successful_sends}\n"
-                f"❌ Failed: {failed_sends}\n"
-                f"📋 Total: {len(active_users)}\n"
-                f"📩 Messages sent: {len(broadcast_messages)}"
+            job = await self.broadcast_jobs.find_one_and_update(
+                {"_id": job_id, "status": {"$in": ["scheduled", "preparing"]}},
+                {"$set": {"status": "preparing"}},
+                return_document=ReturnDocument.AFTER
             )
+            if not job:
+                # Cancelled, or already snapshotted before a restart
+                return
             
-            await update.message.reply_text(summary)
-            logger.info(f"All broadcast completed - Success: {successful_sends}, Failed: {failed_sends}, Messages: {len(broadcast_messages)}")
-            
+            await self.snapshot_broadcast_audience(job, release=False)
+            logger.info(f"Snapshotted {job['total_users']} users for scheduled broadcast job {job_id}")
         except Exception as e:
-            logger.error(f"Error during all broadcast: {e}")
-            await update.message.reply_text(f"❌ All broadcast failed: {str(e)}")
-            # Clear broadcast mode on error
-            context.user_data['broadcast_mode'] = False
-            context.user_data['broadcast_messages'] = []
+            # The send snapshots the audience itself if this one didn't finish
+            logger.error(f"Error snapshotting scheduled broadcast job {job_id}: {e}")
+        finally:
+            self.scheduled_snapshots.pop(job_id, None)
+    
+    async def start_scheduled_job(self, context: ContextTypes.DEFAULT_TYPE):
+        self.start_background_task(self.scheduled_broadcast(context.bot, context.job.data))
+    
+    async def scheduled_broadcast(self, bot, job_id):
+        # A snapshot started just before a restart may still be running
+        snapshot = self.scheduled_snapshots.get(job_id)
+        if snapshot:
+            await asyncio.gather(snapshot, return_exceptions=True)
+        
+        async with self.broadcast_order:
+            job = await self.broadcast_jobs.find_one({"_id": job_id, "status": {"$in": SCHEDULED_STATES}})
+            if not job:
+                # Cancelled in the meantime
+                return
+            
+            try:
+                if job['status'] == "ready":
+                    await self.release_broadcast_job(job)
+                else:
+                    await self.snapshot_broadcast_audience(job)
+                
+                if not job['total_users']:
+                    await self.discard_broadcast_job(job)
+                    await bot.send_message(chat_id=job['admin_id'], text="❌ No active users to broadcast to!")
+                    return
+                
+                logger.info(f"Starting scheduled broadcast job {job_id} to {job['total_users']} users")
+                await self.run_broadcast_job(bot, job)
+            except Exception as e:
+                logger.error(f"Error during scheduled broadcast job {job_id}: {e}")
+                await bot.send_message(chat_id=job['admin_id'], text=f"❌ Scheduled broadcast failed: {str(e)}")
     
     async def user_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -591,23 +2068,16 @@ class PremiumBot:
             return
         
         # Save user to database
-        self.save_user(user_id, username)
+        await self.save_user(user_id, username)
         
         # Skip if message is from admin
         if user_id == self.admin_id:
             return
         
-        # Send "wait for reply" message to user with auto-delete after 20 seconds
+        # Send "wait for reply" message to user, deleted again shortly after
         try:
             wait_message = await update.message.reply_text("🚀 Message sent to admin, wait for reply!")
-            
-            # Schedule deletion after 0.5 seconds
-            if context.job_queue:
-                context.job_queue.run_once(
-                    callback=lambda job_context: self.delete_message_callback(job_context, user_id, wait_message.message_id),
-                    when=0.5,
-                    data={'chat_id': user_id, 'message_id': wait_message.message_id}
-                )
+            self.schedule_deletion(context.bot, user_id, wait_message.message_id)
         except Exception as e:
             logger.error(f"Error sending wait message to user: {e}")
         
@@ -616,40 +2086,74 @@ class PremiumBot:
             forward_text = f"💬 Message from User:\n👤 @{username} (ID: {user_id})\n\n"
             
             if update.message.text:
-                await context.bot.send_message(
+                forwarded = [await context.bot.send_message(
                     chat_id=self.admin_id,
                     text=f"{forward_text}{update.message.text}"
-                )
+                )]
             elif update.message.photo:
-                await context.bot.send_photo(
+                forwarded = [await context.bot.send_photo(
                     chat_id=self.admin_id,
                     photo=update.message.photo[-1].file_id,
                     caption=f"{forward_text}{update.message.caption or ''}"
-                )
+                )]
             elif update.message.document:
-                await context.bot.send_document(
+                forwarded = [await context.bot.send_document(
                     chat_id=self.admin_id,
                     document=update.message.document.file_id,
                     caption=f"{forward_text}{update.message.caption or ''}"
-                )
+                )]
             elif update.message.video:
-                await context.bot.send_video(
+                forwarded = [await context.bot.send_video(
                     chat_id=self.admin_id,
                     video=update.message.video.file_id,
                     caption=f"{forward_text}{update.message.caption or ''}"
-                )
+                )]
+            else:
+                # Voice notes, stickers, audio, ...: the header, then a copy of the message
+                forwarded = [
+                    await context.bot.send_message(chat_id=self.admin_id, text=forward_text.rstrip()),
+                    await context.bot.copy_message(
+                        chat_id=self.admin_id,
+                        from_chat_id=update.message.chat_id,
+                        message_id=update.message.message_id
+                    )
+                ]
+            
+            # Replying to any of these messages reaches the user
+            for message in forwarded:
+                await self.route_index.record(message.message_id, user_id)
             
             logger.info(f"Forwarded message from user {user_id} to admin")
             
         except Exception as e:
             logger.error(f"Error forwarding user message to admin: {e}")
     
-    async def delete_message_callback(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int):
-        try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-            logger.info(f"Auto-deleted wait message for user {chat_id}")
-        except Exception as e:
-            logger.error(f"Error deleting wait message for user {chat_id}: {e}")
+    def schedule_deletion(self, bot, chat_id: int, message_id: int):
+        # Entries share one delay, so the queue is ordered by due time. The drain task is
+        # started when the queue stops being empty and exits once it is empty again.
+        self.pending_deletions.append((time.monotonic() + self.wait_message_delay, chat_id, message_id))
+        if not self.deletion_task or self.deletion_task.done():
+            self.deletion_task = self.start_background_task(self.drain_deletions(bot))
+    
+    async def drain_deletions(self, bot):
+        async def delete(chat_id: int, message_id: int):
+            try:
+                await self.broadcaster.call(bot.delete_message, chat_id=chat_id, message_id=message_id)
+            except Exception as e:
+                logger.error(f"Error deleting wait message for user {chat_id}: {e}")
+        
+        # Concurrent, but paced by the same limiter as every other bulk call
+        while self.pending_deletions:
+            now = time.monotonic()
+            due_at = self.pending_deletions[0][0]
+            if due_at > now:
+                await asyncio.sleep(due_at - now)
+                continue
+            
+            due = []
+            while self.pending_deletions and self.pending_deletions[0][0] <= now and len(due) < self.broadcaster.concurrency:
+                due.append(self.pending_deletions.popleft())
+            await asyncio.gather(*(delete(chat_id, message_id) for _, chat_id, message_id in due))
     
     async def broadcast_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Only admin can broadcast
@@ -668,145 +2172,389 @@ class PremiumBot:
         
         # Check if admin is in broadcast collection mode
         if context.user_data.get('broadcast_mode'):
-            # Collect messages for all broadcast
-            message_data = {}
-            
-            if update.message.text:
-                message_data = {
-                    'type': 'text',
-                    'content': update.message.text
-                }
-            elif update.message.photo:
-                message_data = {
-                    'type': 'photo',
-                    'file_id': update.message.photo[-1].file_id,
-                    'caption': update.message.caption or ''
-                }
-            elif update.message.video:
-                message_data = {
-                    'type': 'video',
-                    'file_id': update.message.video.file_id,
-                    'caption': update.message.caption or ''
-                }
-            elif update.message.document:
-                message_data = {
-                    'type': 'document',
-                    'file_id': update.message.document.file_id,
-                    'caption': update.message.caption or ''
-                }
-            
-            if message_data:
-                context.user_data['broadcast_messages'].append(message_data)
-                await update.message.reply_text(f"✅ Message {len(context.user_data['broadcast_messages'])} collected for all broadcast! Send /done to broadcast all messages.")
-                logger.info(f"Collected message {len(context.user_data['broadcast_messages'])} for all broadcast")
-            
+            # Collect messages for all broadcast (album members are grouped again at /done)
+            context.user_data['broadcast_messages'].append(capture_message(update.message))
+            await update.message.reply_text(f"✅ Message {len(context.user_data['broadcast_messages'])} collected for all broadcast! Send /done to broadcast all messages, or /schedule <time> to send them later.")
+            logger.info(f"Collected message {len(context.user_data['broadcast_messages'])} for all broadcast")
             return
-            
-        # Regular premium broadcast
+        
+        # Albums arrive as one update per item; wait for the rest before broadcasting
+        media_group_id = update.message.media_group_id
+        if media_group_id and context.job_queue:
+            album = self.pending_albums.setdefault(media_group_id, [])
+            album.append(capture_message(update.message))
+            if len(album) == 1:
+                context.job_queue.run_once(self.flush_album_job, when=self.album_wait, data=media_group_id)
+            return
+        
+        # Regular premium broadcast, sent in the background
+        self.start_background_task(self.premium_broadcast(context.bot, [capture_message(update.message)]))
+    
+    async def flush_album_job(self, context: ContextTypes.DEFAULT_TYPE):
+        album = self.pending_albums.pop(context.job.data, [])
+        if album:
+            album.sort(key=lambda item: item['message_id'])
+            self.start_background_task(self.premium_broadcast(context.bot, album))
+    
+    async def premium_broadcast(self, bot, items: list):
+        async with self.broadcast_order:
+            await self.send_premium_broadcast(bot, items)
+    
+    async def send_premium_broadcast(self, bot, items: list):
         try:
-            premium_users = list(self.premium_users.find())
+            job = await self.create_broadcast_job('premium', self.admin_id, "📢 Premium Broadcast:\n\n", items)
             
-            if not premium_users:
+            if not job['total_users']:
+                await self.discard_broadcast_job(job)
                 logger.info("No premium users to broadcast to")
                 return
-                
-            successful_sends = 0
-            failed_sends = 0
             
-            broadcast_log = {
-                "admin_id": update.effective_user.id,
-                "message_text": update.message.text or "Media message",
-                "timestamp": datetime.now(),
-                "total_users": len(premium_users),
-                "successful_sends": 0,
-                "failed_sends": 0
-            }
+            logger.info(f"Starting broadcast to {job['total_users']} premium users")
             
-            logger.info(f"Starting broadcast to {len(premium_users)} premium users")
+            # The broadcast log is written when the job finishes
+            await self.run_broadcast_job(bot, job)
             
-            # Send message to all premium users
-            for user in premium_users:
+        except Exception as e:
+            logger.error(f"Error during broadcast: {e}")
+    
+    async def deliver_payload(self, bot, chat_id: int, prepared: list, bulk: bool = True):
+        for method_name, kwargs in prepared:
+            method = getattr(bot, method_name)
+            if bulk:
+                await self.broadcaster.call(method, chat_id=chat_id, **kwargs)
+            else:
+                await method(chat_id=chat_id, **kwargs)
+    
+    async def iter_premium_audience(self):
+        async for batch in self.premium_users.iter_batches({}, {"user_id": 1, "_id": 0}):
+            for user in batch:
+                yield user['user_id']
+    
+    async def create_broadcast_job(self, kind: str, admin_id: int, header: str, items: list, segment: dict = None,
+                                   run_at: datetime = None):
+        job = {
+            "kind": kind,
+            "admin_id": admin_id,
+            "segment": segment or {},
+            "payload": compile_payload(items, header),
+            "message_text": next((item['text'] for item in items if 'text' in item), "Media message"),
+            "message_count": len(items),
+            "status": "scheduled" if run_at else "snapshot",
+            "created_date": datetime.now(),
+            "total_users": 0,
+            "successful_sends": 0,
+            "failed_sends": 0
+        }
+        
+        if run_at:
+            job['run_at'] = run_at
+        
+        result = await self.broadcast_jobs.insert_one(job)
+        job['_id'] = result.inserted_id
+        
+        if run_at:
+            # The audience is snapshotted shortly before run_at, from the job queue
+            return job
+        
+        try:
+            await self.snapshot_broadcast_audience(job)
+        except Exception:
+            await self.discard_broadcast_job(job)
+            raise
+        
+        return job
+    
+    async def snapshot_broadcast_audience(self, job, release: bool = True):
+        # Freeze the audience into fixed-size chunks; each chunk is the unit of checkpointing
+        await self.broadcast_chunks.delete_many({"job_id": job['_id']})
+        
+        audience = self.iter_premium_audience() if job['kind'] == 'premium' else self.iter_audience(job.get('segment'))
+        total_users = 0
+        seq = 0
+        user_ids = []
+        
+        async for user_id in audience:
+            user_ids.append(user_id)
+            total_users += 1
+            
+            if len(user_ids) >= self.broadcast_chunk_size:
+                await self.broadcast_chunks.insert_one({"job_id": job['_id'], "seq": seq, "status": "waiting", "user_ids": user_ids})
+                seq += 1
+                user_ids = []
+        
+        if user_ids:
+            await self.broadcast_chunks.insert_one({"job_id": job['_id'], "seq": seq, "status": "waiting", "user_ids": user_ids})
+        
+        job['total_users'] = total_users
+        if release:
+            await self.release_broadcast_job(job)
+        else:
+            # A scheduled job keeps its chunks waiting until the send time
+            result = await self.broadcast_jobs.update_one(
+                {"_id": job['_id'], "status": {"$in": SCHEDULED_STATES}},
+                {"$set": {"status": "ready", "total_users": total_users}}
+            )
+            if not result.matched_count:
+                # Cancelled while the snapshot was written
+                await self.broadcast_chunks.delete_many({"job_id": job['_id']})
+                return
+            job['status'] = "ready"
+    
+    async def release_broadcast_job(self, job):
+        # Workers only see the chunks once the whole audience is written
+        await self.broadcast_chunks.update_many(
+            {"job_id": job['_id'], "status": "waiting"},
+            {"$set": {"status": "pending"}}
+        )
+        await self.broadcast_jobs.update_one(
+            {"_id": job['_id']},
+            {"$set": {"status": "running", "total_users": job['total_users']}}
+        )
+        job['status'] = "running"
+    
+    async def discard_broadcast_job(self, job):
+        await self.broadcast_chunks.delete_many({"job_id": job['_id']})
+        await self.broadcast_jobs.delete_one({"_id": job['_id']})
+    
+    async def claim_broadcast_chunk(self, job_id=None):
+        # Lease the next pending chunk (of one job, or of any job), or one whose holder
+        # stopped heartbeating. Leases are in UTC, workers may run in other timezones.
+        now = datetime.utcnow()
+        query = {"$or": [{"status": "pending"}, {"status": "leased", "lease_expires": {"$lt": now}}]}
+        if job_id is not None:
+            query['job_id'] = job_id
+        
+        return await self.broadcast_chunks.find_one_and_update(
+            query,
+            {"$set": {"status": "leased", "lease_owner": self.worker_id, "lease_expires": now + self.broadcast_lease}},
+            sort=[("job_id", 1), ("seq", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def process_broadcast_chunk(self, bot, chunk, prepared: list):
+        async def send(chat_id):
+            await self.deliver_payload(bot, chat_id, prepared)
+        
+        lease = {"_id": chunk['_id'], "status": "leased", "lease_owner": self.worker_id}
+        sending = asyncio.create_task(self.broadcaster.run(chunk['user_ids'], send))
+        try:
+            while not sending.done():
+                await asyncio.wait({sending}, timeout=self.broadcast_lease.total_seconds() / 3)
+                if sending.done():
+                    break
+                
+                # Heartbeat; if the lease was lost another worker has taken the chunk over
                 try:
-                    if update.message.text:
-                        await context.bot.send_message(
-                            chat_id=user['user_id'],
-                            text=f"📢 Premium Broadcast:\n\n{update.message.text}"
-                        )
-                    elif update.message.photo:
-                        await context.bot.send_photo(
-                            chat_id=user['user_id'],
-                            photo=update.message.photo[-1].file_id,
-                            caption=f"📢 Premium Broadcast:\n\n{update.message.caption or ''}"
-                        )
-                    elif update.message.document:
-                        await context.bot.send_document(
-                            chat_id=user['user_id'],
-                            document=update.message.document.file_id,
-                            caption=f"📢 Premium Broadcast:\n\n{update.message.caption or ''}"
-                        )
-                    elif update.message.video:
-                        await context.bot.send_video(
-                            chat_id=user['user_id'],
-                            video=update.message.video.file_id,
-                            caption=f"📢 Premium Broadcast:\n\n{update.message.caption or ''}"
-                        )
-                    
-                    successful_sends += 1
-                    
-                except Exception as e:
-                    logger.error(f"Failed to send message to user {user['user_id']}: {e}")
-                    failed_sends += 1
+                    result = await self.broadcast_chunks.update_one(
+                        lease,
+                        {"$set": {"lease_expires": datetime.utcnow() + self.broadcast_lease}}
+                    )
+                except TRANSIENT_MONGO_ERRORS as e:
+                    # Tried again on the next beat; the lease has two more beats of slack
+                    logger.warning(f"Heartbeat for broadcast chunk {chunk['_id']} failed: {e}")
+                    continue
+                if not result.matched_count:
+                    logger.warning(f"Lost lease on broadcast chunk {chunk['_id']}, stopping it")
+                    sending.cancel()
+                    return False
+        except asyncio.CancelledError:
+            # Shutting down: hand the chunk back instead of waiting for the lease to expire
+            sending.cancel()
+            await self.broadcast_chunks.update_one(
+                lease,
+                {"$set": {"status": "pending"}, "$unset": {"lease_owner": "", "lease_expires": ""}}
+            )
+            raise
+        except BaseException:
+            # Never leave the sends running once nobody holds the lease for them
+            sending.cancel()
+            raise
+        
+        successful_sends, failed_sends = sending.result()
+        
+        # Checkpoint: a restart or another worker resumes after the last finished chunk
+        result = await self.retry_mongo(
+            lambda: self.broadcast_chunks.update_one(
+                lease,
+                {
+                    "$set": {"status": "done", "successful_sends": successful_sends, "failed_sends": failed_sends},
+                    "$unset": {"lease_owner": "", "lease_expires": ""}
+                }
+            ),
+            f"checkpointing broadcast chunk {chunk['_id']}"
+        )
+        return bool(result.matched_count)
+    
+    async def retry_mongo(self, operation, description: str):
+        # Back off on transient errors instead of giving up on a half-sent broadcast
+        delay = self.broadcast_poll_interval
+        while True:
+            try:
+                return await operation()
+            except TRANSIENT_MONGO_ERRORS as e:
+                logger.warning(f"MongoDB error while {description}, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.broadcast_lease.total_seconds())
+    
+    async def run_broadcast_job(self, bot, job):
+        # A job is only driven by one task per process; other processes may work on it too
+        if job['_id'] in self.active_jobs:
+            return
+        self.active_jobs.add(job['_id'])
+        
+        try:
+            prepared = prepare_payload(job['payload'])
+            
+            while True:
+                chunk = await self.retry_mongo(
+                    lambda: self.claim_broadcast_chunk(job['_id']),
+                    f"claiming a chunk of broadcast job {job['_id']}"
+                )
+                if chunk:
+                    await self.process_broadcast_chunk(bot, chunk, prepared)
+                    continue
+                
+                # Chunks still leased are in flight on another worker, or held by a process
+                # that died; those are claimed again here once their lease expires
+                remaining = await self.retry_mongo(
+                    lambda: self.broadcast_chunks.count_documents({"job_id": job['_id'], "status": {"$ne": "done"}}, limit=1),
+                    f"checking broadcast job {job['_id']}"
+                )
+                if not remaining:
+                    break
+                await asyncio.sleep(self.broadcast_poll_interval)
             
-            # Update broadcast log
-            broadcast_log["successful_sends"] = successful_sends
-            broadcast_log["failed_sends"] = failed_sends
-            self.broadcast_logs.insert_one(broadcast_log)
+            await self.complete_broadcast_job(bot, job)
+        finally:
+            self.active_jobs.discard(job['_id'])
+    
+    async def complete_broadcast_job(self, bot, job):
+        # Chunks leased by other workers may still be in flight; whoever finishes the
+        # last one finalizes the job, and only once
+        if await self.broadcast_chunks.count_documents({"job_id": job['_id'], "status": {"$ne": "done"}}, limit=1):
+            return
+        
+        claimed = await self.broadcast_jobs.find_one_and_update(
+            {"_id": job['_id'], "status": "running"},
+            {"$set": {"status": "finishing"}}
+        )
+        if claimed:
+            await self.finalize_broadcast_job(bot, job)
+    
+    async def finalize_broadcast_job(self, bot, job):
+        totals = await self.broadcast_chunks.aggregate([
+            {"$match": {"job_id": job['_id']}},
+            {"$group": {"_id": None, "successful": {"$sum": "$successful_sends"}, "failed": {"$sum": "$failed_sends"}}}
+        ])
+        job['successful_sends'] = totals[0]['successful'] if totals else 0
+        job['failed_sends'] = totals[0]['failed'] if totals else 0
+        job['status'] = "done"
+        
+        await self.broadcast_jobs.update_one(
+            {"_id": job['_id']},
+            {
+                "$set": {
+                    "status": "done",
+                    "completed_date": datetime.now(),
+                    "successful_sends": job['successful_sends'],
+                    "failed_sends": job['failed_sends']
+                }
+            }
+        )
+        await self.broadcast_chunks.delete_many({"job_id": job['_id']})
+        
+        await self.finish_broadcast_job(bot, job)
+    
+    async def broadcast_worker_loop(self, bot):
+        # Standalone broadcast worker: keep claiming chunks of any running job
+        while True:
+            try:
+                chunk = await self.claim_broadcast_chunk()
+                if not chunk:
+                    await asyncio.sleep(self.broadcast_poll_interval)
+                    continue
+                
+                job = await self.broadcast_jobs.find_one({"_id": chunk['job_id']})
+                if not job:
+                    # Left over from a discarded job
+                    await self.broadcast_chunks.delete_one({"_id": chunk['_id']})
+                    continue
+                
+                await self.process_broadcast_chunk(bot, chunk, prepare_payload(job['payload']))
+                await self.complete_broadcast_job(bot, job)
+            except Exception as e:
+                # The chunk's lease runs out and it is picked up again
+                logger.error(f"Error in broadcast worker: {e}")
+                await asyncio.sleep(self.broadcast_poll_interval)
+    
+    async def finish_broadcast_job(self, bot, job):
+        successful_sends = job['successful_sends']
+        failed_sends = job['failed_sends']
+        
+        if job['kind'] == 'premium':
+            broadcast_log = {
+                "admin_id": job['admin_id'],
+                "message_text": job['message_text'],
+                "timestamp": job['created_date'],
+                "total_users": job['total_users'],
+                "successful_sends": successful_sends,
+                "failed_sends": failed_sends
+            }
+            await self.broadcast_logs.insert_one(broadcast_log)
+            await self.increment_counter("count", counter_id=f"broadcasts:{job['created_date'].strftime('%Y-%m-%d')}")
             
             # Don't send summary to admin anymore
             logger.info(f"Broadcast completed - Success: {successful_sends}, Failed: {failed_sends}")
+        else:
+            # Send summary to admin
+            summary = (
+                f"📊 All Broadcast Summary:\n"
+                f"🎯 Audience: {describe_segment(job.get('segment') or {})}\n"
+                f"✅ Successful: {successful_sends}\n"
+                f"❌ Failed: {failed_sends}\n"
+                f"📋 Total: {job['total_users']}\n"
+                f"📩 Messages sent: {job['message_count']}"
+            )
             
+            await bot.send_message(chat_id=job['admin_id'], text=summary)
+            logger.info(f"All broadcast completed - Success: {successful_sends}, Failed: {failed_sends}, Messages: {job['message_count']}")
+    
+    async def resume_broadcast_job(self, bot, job):
+        try:
+            if job['status'] == "snapshot":
+                # Nothing was sent before the snapshot finished, so it is simply rebuilt
+                await self.snapshot_broadcast_audience(job)
+            elif job['status'] == "finishing":
+                # Every chunk was sent; only the totals and the summary are missing
+                await self.finalize_broadcast_job(bot, job)
+                return
+            
+            logger.info(f"Resuming {job['kind']} broadcast job {job['_id']}")
+            await self.run_broadcast_job(bot, job)
         except Exception as e:
-            logger.error(f"Error during broadcast: {e}")
+            logger.error(f"Error resuming broadcast job {job['_id']}: {e}")
     
     async def handle_admin_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             replied_message = update.message.reply_to_message
+            if not replied_message:
+                return
             
-            # Extract user ID from the forwarded message
-            if replied_message and replied_message.text:
-                # Look for user ID pattern in the forwarded message
-                import re
-                match = re.search(r'ID: (\d+)', replied_message.text)
+            target_user_id = await self.route_index.lookup(replied_message.message_id)
+            
+            if target_user_id is None:
+                # Forwarded before routes were recorded: read the ID from the header
+                match = USER_ID_PATTERN.search(replied_message.text or replied_message.caption or '')
                 if match:
                     target_user_id = int(match.group(1))
-                    
-                    # Send admin's reply to the user
-                    if update.message.text:
-                        await context.bot.send_message(
-                            chat_id=target_user_id,
-                            text=f"💬 Admin Reply:\n\n{update.message.text}"
-                        )
-                    elif update.message.photo:
-                        await context.bot.send_photo(
-                            chat_id=target_user_id,
-                            photo=update.message.photo[-1].file_id,
-                            caption=f"💬 Admin Reply:\n\n{update.message.caption or ''}"
-                        )
-                    elif update.message.document:
-                        await context.bot.send_document(
-                            chat_id=target_user_id,
-                            document=update.message.document.file_id,
-                            caption=f"💬 Admin Reply:\n\n{update.message.caption or ''}"
-                        )
-                    elif update.message.video:
-                        await context.bot.send_video(
-                            chat_id=target_user_id,
-                            video=update.message.video.file_id,
-                            caption=f"💬 Admin Reply:\n\n{update.message.caption or ''}"
-                        )
-                    
-                    logger.info(f"Admin replied to user {target_user_id}")
-                    
+            
+            if target_user_id is not None:
+                # Send admin's reply to the user
+                payload = prepare_payload(compile_payload([capture_message(update.message)], "💬 Admin Reply:\n\n"))
+                await self.deliver_payload(context.bot, target_user_id, payload, bulk=False)
+                
+                logger.info(f"Admin replied to user {target_user_id}")
+                
         except Exception as e:
             logger.error(f"Error handling admin reply: {e}")
     
@@ -816,13 +2564,12 @@ class PremiumBot:
             return
             
         try:
-            premium_count = self.premium_users.count_documents({})
-            channels_count = self.premium_channels.count_documents({})
-            total_users = self.all_users.count_documents({})
-            banned_count = self.banned_users.count_documents({})
-            recent_broadcasts = self.broadcast_logs.count_documents({
-                "timestamp": {"$gte": datetime.now().replace(hour=0, minute=0, second=0)}
-            })
+            counters = await self.read_counters()
+            premium_count = counters['premium_users']
+            channels_count = counters['premium_channels']
+            total_users = counters['total_users']
+            banned_count = counters['banned_users']
+            recent_broadcasts = counters['broadcasts_today']
             
             stats_message = (
                 f"📊 Bot Statistics:\n\n"
@@ -839,59 +2586,365 @@ class PremiumBot:
         except Exception as e:
             logger.error(f"Error fetching stats: {e}")
             await update.message.reply_text(f"❌ Error fetching stats: {str(e)}")
+    
+    async def profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user.id != self.admin_id:
+            await update.message.reply_text("❌ Only admin can use this command!")
+            return
+        
+        try:
+            seconds = int(context.args[0]) if context.args else 30
+        except ValueError:
+            await update.message.reply_text("Usage: /profile <seconds>")
+            return
+        
+        if not 1 <= seconds <= 300:
+            await update.message.reply_text("❌ Profile duration must be between 1 and 300 seconds!")
+            return
+        
+        if self.profiling:
+            await update.message.reply_text("❌ A profile is already running!")
+            return
+        
+        self.profiling = True
+        await update.message.reply_text(f"🔬 Profiling for {seconds} seconds, the report follows as a document.")
+        
+        # Runs in the background so the bot keeps handling updates while it is sampled
+        self.start_background_task(self.run_profile(context.bot, update.effective_chat.id, seconds))
+    
+    async def run_profile(self, bot, chat_id: int, seconds: int):
+        loop = asyncio.get_running_loop()
+        started_tracing = not tracemalloc.is_tracing()
+        
+        try:
+            if started_tracing:
+                tracemalloc.start(10)
+            before = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+            
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            
+            after = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+            if started_tracing:
+                tracemalloc.stop()
+            
+            report = await loop.run_in_executor(None, format_profile_report, profiler, before, after, seconds)
+            await bot.send_document(
+                chat_id=chat_id,
+                document=report.encode(),
+                filename=f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt",
+                caption=f"🔬 Profile of the last {seconds} seconds"
+            )
+            logger.info(f"Admin profiled the bot for {seconds}s")
+        except Exception as e:
+            logger.error(f"Error profiling: {e}")
+            await bot.send_message(chat_id=chat_id, text=f"❌ Profiling failed: {str(e)}")
+        finally:
+            if started_tracing and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self.profiling = False
 
-def main():
-    bot = PremiumBot()
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # Updates of different chats run concurrently; updates of one chat run one after another
+    # in arrival order. The chat lock is taken before a concurrency slot, so a busy chat
+    # waits in line without holding slots the other chats need. PTB's own semaphore is
+    # taken before do_process_update, so it is left unlimited and the slots are ours.
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(sys.maxsize)
+        self.slots = asyncio.Semaphore(max_concurrent_updates)
+        self.chat_locks = {}
     
-    if not bot.bot_token:
-        logger.error("BOT_TOKEN not found in environment variables")
-        return
+    async def do_process_update(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            if update.effective_chat:
+                key = update.effective_chat.id
+            elif update.effective_user:
+                key = update.effective_user.id
         
-    if not bot.mongodb_url:
-        logger.error("MONGODB_URL not found in environment variables")
-        return
+        if key is None:
+            async with self.slots:
+                await coroutine
+            return
         
-    if not bot.admin_id:
-        logger.error("ADMIN_ID not found in environment variables")
-        return
+        # [lock, number of updates holding or waiting for it]
+        entry = self.chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self.slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chat_locks[key]
+    
+    async def initialize(self):
+        pass
     
+    async def shutdown(self):
+        pass
+
+def application_builder(bot: PremiumBot):
+    builder = Application.builder().token(bot.bot_token)
+    
+    # Alternative Bot API server (a local Bot API server or the benchmark fake)
+    if bot.api_url:
+        builder = builder.base_url(f"{bot.api_url}/bot").base_file_url(f"{bot.api_url}/file/bot")
+    
+    return builder
+
+def build_application(bot: PremiumBot, updater: bool = True):
     # Create application with job queue
-    from telegram.ext import JobQueue
-    application = Application.builder().token(bot.bot_token).build()
+    builder = application_builder(bot).post_init(bot.post_init).post_shutdown(bot.post_shutdown)
+    if bot.concurrent_updates > 0:
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(bot.concurrent_updates))
+    if not updater:
+        builder = builder.updater(None)
+    
+    application = builder.build()
     
     # Add handlers
-    application.add_handler(CommandHandler("start", bot.start))
-    application.add_handler(CommandHandler("addpremium", bot.add_premium))
-    application.add_handler(CommandHandler("removepremium", bot.remove_premium))
-    application.add_handler(CommandHandler("listpremium", bot.list_premium))
-    application.add_handler(CommandHandler("addchannel", bot.add_channel))
-    application.add_handler(CommandHandler("listchannels", bot.list_channels))
-    application.add_handler(CommandHandler("removechannel", bot.remove_channel))
-    application.add_handler(CommandHandler("banuser", bot.ban_user))
-    application.add_handler(CommandHandler("unbanuser", bot.unban_user))
-    application.add_handler(CommandHandler("listbanned", bot.list_banned))
-    application.add_handler(CommandHandler("totalusers", bot.total_users))
-    application.add_handler(CommandHandler("allbroadcast", bot.allbroadcast))
-    application.add_handler(CommandHandler("done", bot.done_broadcast))
-    application.add_handler(CommandHandler("stats", bot.stats))
-    application.add_handler(CallbackQueryHandler(bot.buy_premium_callback, pattern="buy_premium"))
+    application.add_handler(CommandHandler("start", timed(bot.start)))
+    application.add_handler(CommandHandler("addpremium", timed(bot.add_premium)))
+    application.add_handler(CommandHandler("removepremium", timed(bot.remove_premium)))
+    application.add_handler(CommandHandler("listpremium", timed(bot.list_premium)))
+    application.add_handler(CommandHandler("addchannel", timed(bot.add_channel)))
+    application.add_handler(CommandHandler("listchannels", timed(bot.list_channels)))
+    application.add_handler(CommandHandler("removechannel", timed(bot.remove_channel)))
+    application.add_handler(CommandHandler("banuser", timed(bot.ban_user)))
+    application.add_handler(CommandHandler("unbanuser", timed(bot.unban_user)))
+    application.add_handler(CommandHandler("listbanned", timed(bot.list_banned)))
+    application.add_handler(CommandHandler("totalusers", timed(bot.total_users)))
+    application.add_handler(CommandHandler("allbroadcast", timed(bot.allbroadcast)))
+    application.add_handler(CommandHandler("done", timed(bot.done_broadcast)))
+    application.add_handler(CommandHandler("schedule", timed(bot.schedule)))
+    application.add_handler(CommandHandler("unschedule", timed(bot.unschedule)))
+    application.add_handler(CommandHandler("stats", timed(bot.stats)))
+    application.add_handler(CommandHandler("profile", timed(bot.profile)))
+    application.add_handler(CallbackQueryHandler(timed(bot.buy_premium_callback), pattern="buy_premium"))
+    application.add_handler(CallbackQueryHandler(timed(bot.list_page_callback), pattern="^list:"))
+    
+    # Premium channel joins/leaves (the bot must be an admin of each channel)
+    application.add_handler(ChatMemberHandler(timed(bot.track_channel_member), ChatMemberHandler.CHAT_MEMBER))
     
     # Message handler for admin broadcasts (excluding commands)
     application.add_handler(MessageHandler(
         filters.ALL & ~filters.COMMAND & filters.User(bot.admin_id), 
-        bot.broadcast_handler
+        timed(bot.broadcast_handler)
     ))
     
     # Message handler for user messages (excluding admin and commands)
     application.add_handler(MessageHandler(
         filters.ALL & ~filters.COMMAND & ~filters.User(bot.admin_id), 
-        bot.user_message_handler
+        timed(bot.user_message_handler)
     ))
     
+    return application
+
+class UpdateDispatcher:
+    # Front process of multi-process mode: every update of a user goes to the same worker,
+    # so per-user ordering is kept while different users are handled in parallel
+    def __init__(self, worker_count: int, metrics_port: int = 0):
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue() for _ in range(worker_count)]
+        self.events = context.Queue()
+        self.workers = [
+            context.Process(target=run_update_worker, args=(index, queue, self.events), name=f"update-worker-{index}")
+            for index, queue in enumerate(self.queues)
+        ]
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+    
+    def start_workers(self):
+        for worker in self.workers:
+            worker.start()
+        logger.info(f"Started {len(self.workers)} update workers")
+    
+    def stop_workers(self):
+        # Workers finish the updates already queued to them, then flush and exit
+        for queue in self.queues:
+            queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=30)
+        self.events.put(None)
+        logger.info("Update workers stopped")
+    
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.chat_member:
+            # effective_user is whoever made the change (e.g. the admin kicking someone);
+            # the member's own worker holds the membership index that /start reads
+            key = update.chat_member.new_chat_member.user.id
+        elif update.effective_user:
+            key = update.effective_user.id
+        elif update.effective_chat:
+            key = update.effective_chat.id
+        else:
+            key = 0
+        self.queues[key % len(self.queues)].put(("update", update.to_dict()))
+    
+    async def relay_events(self, application: Application):
+        # Fan cache changes made in one worker (ban, premium, channels) out to all of them
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, self.events.get)
+            if event is None:
+                return
+            for queue in self.queues:
+                queue.put(("event", event))
+    
+    async def post_init(self, application: Application):
+        self.relay_task = asyncio.get_running_loop().create_task(self.relay_events(application))
+        
+        if self.metrics_port:
+            METRICS.gauge("bot_update_queue_depth", "Updates received but not yet handled", application.update_queue.qsize)
+            self.metrics_server = start_metrics_server(self.metrics_port)
+    
+    async def post_shutdown(self, application: Application):
+        # Joining happens off the event loop so events keep being relayed while workers drain
+        await asyncio.get_running_loop().run_in_executor(None, self.stop_workers)
+        await self.relay_task
+        
+        if self.metrics_server:
+            self.metrics_server.stop()
+
+def run_update_worker(index: int, updates, events):
+    # Shutdown is driven by the front process, not by the terminal's Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    bot = PremiumBot()
+    bot.primary = index == 0
+    bot.peer_events = events
+    # Every worker keeps its own invite links; together they keep INVITE_POOL_SIZE per channel
+    bot.invite_pool.size = math.ceil(bot.invite_pool.size / bot.update_workers)
+    bot.invite_pool.low_water = math.ceil(bot.invite_pool.low_water / bot.update_workers)
+    if bot.metrics_port:
+        # The front process serves METRICS_PORT, worker N the port N + 1 above it
+        bot.metrics_port += index + 1
+    asyncio.run(serve_update_worker(bot, updates))
+
+async def serve_update_worker(bot: PremiumBot, updates):
+    application = build_application(bot, updater=False)
+    loop = asyncio.get_running_loop()
+    
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            
+            kind, data = item
+            if kind == "update":
+                await application.update_queue.put(Update.de_json(data, application.bot))
+            else:
+                bot.apply_peer_event(data)
+        
+        await application.stop()
+        await bot.post_shutdown(application)
+
+def run_broadcast_worker(metrics_port: int = None):
+    bot = PremiumBot()
+    bot.primary = False
+    if metrics_port is not None:
+        bot.metrics_port = metrics_port
+    asyncio.run(serve_broadcast_worker(bot))
+
+async def serve_broadcast_worker(bot: PremiumBot):
+    application = application_builder(bot).updater(None).build()
+    
+    # SIGTERM from the parent process or Ctrl+C: hand the current chunk back and exit
+    loop = asyncio.get_running_loop()
+    worker = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.cancel)
+    
+    if bot.metrics_port:
+        bot.metrics_server = start_metrics_server(bot.metrics_port)
+    
+    async with application:
+        logger.info(f"Broadcast worker {bot.worker_id} started")
+        try:
+            await bot.broadcast_worker_loop(application.bot)
+        except asyncio.CancelledError:
+            logger.info(f"Broadcast worker {bot.worker_id} stopped")
+    
+    if bot.metrics_server:
+        bot.metrics_server.stop()
+
+def main():
+    bot = PremiumBot()
+    
+    if not bot.bot_token:
+        logger.error("BOT_TOKEN not found in environment variables")
+        return
+        
+    if not bot.mongodb_url:
+        logger.error("MONGODB_URL not found in environment variables")
+        return
+        
+    if not bot.admin_id:
+        logger.error("ADMIN_ID not found in environment variables")
+        return
+    
+    if sys.argv[1:2] == ['broadcast-worker']:
+        # Extra broadcast capacity, e.g. on another machine: python main.py broadcast-worker
+        run_broadcast_worker()
+        return
+    
+    context = multiprocessing.get_context('spawn')
+    broadcast_workers = [
+        # Local broadcast workers serve metrics on the ports after the update workers'
+        context.Process(
+            target=run_broadcast_worker,
+            args=(bot.metrics_port + bot.update_workers + 1 + index if bot.metrics_port else 0,),
+            name=f"broadcast-worker-{index}"
+        )
+        for index in range(bot.broadcast_workers)
+    ]
+    for worker in broadcast_workers:
+        worker.start()
+    
+    if bot.update_workers > 0:
+        # The front process only receives updates and hands them to the workers
+        dispatcher = UpdateDispatcher(bot.update_workers, bot.metrics_port)
+        application = application_builder(bot).post_init(dispatcher.post_init).post_shutdown(dispatcher.post_shutdown).build()
+        application.add_handler(TypeHandler(Update, timed(dispatcher.dispatch)))
+        dispatcher.start_workers()
+    else:
+        dispatcher = None
+        application = build_application(bot)
+    
     logger.info("Bot started successfully!")
     
     # Start the bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        if bot.webhook_url:
+            # Telegram pushes updates to us over HTTPS (usually behind a reverse proxy)
+            logger.info(f"Serving webhook on {bot.webhook_listen}:{bot.webhook_port}/{bot.webhook_path}")
+            application.run_webhook(
+                listen=bot.webhook_listen,
+                port=bot.webhook_port,
+                url_path=bot.webhook_path,
+                webhook_url=f"{bot.webhook_url.rstrip('/')}/{bot.webhook_path}",
+                secret_token=bot.webhook_secret,
+                max_connections=bot.webhook_max_connections,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        for worker in broadcast_workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in broadcast_workers:
+            worker.join(timeout=30)
 
 if __name__ == '__main__':
     main()